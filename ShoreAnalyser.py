@@ -1,103 +1,184 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 #  Created by Kleomenis Katevas on 14/08/2013.
 #  Copyright (c) 2013 Queen Mary University of London. All rights reserved.
 
 import sys
 import heapq
+import bisect
+import argparse
 import numpy
-import json
 
-from UserString import MutableString
-from datetime import timedelta
-from datetime import datetime
+from array import array
 from math import hypot
 
 import ShoreParser as sp
+import ShoreConfiguration as sc
+import ShoreCheckpoint as sk
+from ShoreConfiguration import CHANNELS, COLUMNS, LAUGH_THRESHOLD
+from ShoreStatistics import STATISTICS, aggregate
+from ShoreInstrumentation import Instrumentation
+from ShoreProfiler import Profiler
+
+# Missing channel values
+NAN = float('nan')
 
 
 class ShoreAnalyser:
     ''' ShoreAnalyser class'''
 
-    def __init__(self, conf_inputs):
+    def __init__(self, conf_inputs, instrumentation=None, resume=False):
 
         # init audience dict
         self.audience = {}
 
-        # set numpy to raise an exception on all errors
-        numpy.seterr(all='raise')
+        # init the offsets added to the Person ids of each input
+        # (by id) when exporting
+        self.offsets = {}
+
+        # resume the analyses from their checkpoints
+        self.resume = resume
+
+        # use a disabled instrumentation if none is given
+        if instrumentation is None:
+            instrumentation = Instrumentation(enabled=False)
+
+        self.instrumentation = instrumentation
+
+        # validate all inputs before analysing any
+        conf_inputs = [sc.compileInput(conf_input)
+                       for conf_input in conf_inputs]
 
         # parse shoredata for each input
         for conf_input in conf_inputs:
 
-            # access properties
-            inputId = conf_input["id"]
-            filename = conf_input["filename"]
-            start_date = self._parseDate(conf_input["start_date"])
+            # analyse audience
+            self.audience[conf_input.id] = self.analyseInput(conf_input)
 
-            # Check for optional key 'output_log'
-            if "output_log" in conf_input.keys():
-                output_log = conf_input["output_log"]
-            else:
-                output_log = None
 
-            # Check for optional key 'start_frame'
-            if "start_frame" in conf_input.keys():
+    def analyseInput(self, conf_input):
+        ''' analyse the input of a configuration and return its Audience '''
 
-                # calculate the correct date based on the starting frame
-                start_frame = conf_input["start_frame"]
-                delta = timedelta(milliseconds=start_frame * 1000 / 29.97)
-                correct_date = start_date - delta
+        # compile the input (if not compiled yet)
+        conf_input = sc.compileInput(conf_input)
 
-                 # print the date
-                print "Corrected date: " + str(correct_date)
+        # the date is already corrected based on the starting frame
+        if conf_input.start_frame is not None:
+            print("Corrected date: " + str(conf_input.start_date))
 
-            else:
-                correct_date = start_date
+        # Check for optional key 'checkpoint'
+        if conf_input.checkpoint is not None:
+            checkpoint = sk.Checkpoint(conf_input.checkpoint,
+                                       sk.fingerprint(conf_input),
+                                       conf_input.checkpoint_interval)
+        else:
+            checkpoint = None
 
-            # Check for optional key 'filters'
-            if "filters" in conf_input.keys():
-                filters = conf_input["filters"]
-            else:
-                filters = None
+        # analyse audience
+        return self.analyse(conf_input.filename, conf_input.start_date,
+                            conf_input.filters, conf_input.output_log,
+                            conf_input.sample_rate, checkpoint, self.resume)
 
-            # analyse audience
-            self.audience[inputId] = self.analyse(filename, correct_date,
-                                                  filters, output_log)
 
+    def analyse(self, filename, start_date, filters, output_log,
+                sample_rate=None, checkpoint=None, resume=False):
+
+        # get the saved state of an interrupted analysis
+        if checkpoint is not None and resume:
+            state = checkpoint.load()
+        else:
+            state = None
+
+        # first Person id of this analysis
+        firstId = Person._counter
 
-    def analyse(self, filename, start_date, filters, output_log):
+        if state is not None:
 
-        # init the Audience
-        audience = Audience(filters)
+            # continue the Audience of the checkpoint, its Person ids
+            # follow the Persons created before this analysis
+            audience = Audience(filters, sample_rate)
+            audience.restoreCheckpoint(state["audience"][0],
+                                       state["audience"][1],
+                                       state["people"])
+            offset = state["offset"]
 
-        # open file
-        source = open(filename, 'r')
+            shift = firstId - state["ids"][0]
+            for person in audience._people:
+                person.id += shift
+            Person._counter = state["ids"][1] + shift
 
-        print "Analysing file '%s'.." % (filename)
+            print("Resuming from checkpoint '%s' (byte %d).." %
+                  (checkpoint.filename, offset))
+
+        else:
+
+            # init the Audience
+            audience = Audience(filters, sample_rate)
+            offset = 0
+
+        # get the stages of this file
+        parse = self.instrumentation.stage("parse '%s'" % (filename))
+        track = self.instrumentation.stage("track '%s'" % (filename))
+
+        # open file (plain or compressed), keeping the offset of
+        # each line for the checkpoints
+        if checkpoint is not None:
+            save = self.instrumentation.stage("checkpoint '%s'" % (filename))
+            source = sp.LogReader(filename, offset)
+        else:
+            source = sp.openfile(filename)
+
+        print("Analysing file '%s'.." % (filename))
 
         # parse each line
         for line in source:
 
             # parse the line
+            parse.start()
             measurement = sp.parseline(line, start_date)
+            parse.stop(1)
 
             # read the measurement
+            track.start()
             audience.read(measurement)
+            track.stop(1)
 
-        print "Finished!"
+            # save a checkpoint from time to time
+            if checkpoint is not None and checkpoint.due():
+                with save:
+                    checkpoint.save(source.offset, audience,
+                                    (firstId, Person._counter))
+                    save.count(1)
+
+        # store the detections still pending decimation
+        track.start()
+        audience.flush()
+        track.stop()
+
+        # save the complete analysis, resuming it only reads the end
+        if checkpoint is not None:
+            with save:
+                checkpoint.save(source.offset, audience,
+                                (firstId, Person._counter))
+                save.count(1)
+
+        parse.recordMemory()
+        track.recordMemory()
+
+        print("Finished!")
 
         # close files
         source.close()
 
         # produce and print statistics
-        statistics = audience.statistics()
-        print statistics
+        with self.instrumentation.stage("statistics '%s'" % (filename)):
+            statistics = audience.statistics()
+        print(statistics)
 
         # write Log file
         if output_log is not None:
 
-            print "Exporting log file '%s'." % (output_log)
+            print("Exporting log file '%s'." % (output_log))
 
             with open(output_log, "w") as logfile:
                 logfile.write(statistics)
@@ -108,130 +189,188 @@ class ShoreAnalyser:
 
     def export(self, conf_item):
 
+        # compile the item, its time ranges refer to the analysed inputs
+        conf_item = sc.compileOutput(conf_item, list(self.audience.keys()))
+
         # access properties
-        file_output = conf_item["output"]
-        time_ranges = conf_item["time_ranges"]
+        file_output = conf_item.output
+        time_ranges = conf_item.time_ranges
+        columns = conf_item.columns
+        export_type = conf_item.type
+        threshold = conf_item.laugh_threshold
 
         # open output file
         output = open(file_output, 'w')
 
         # export the header
-        self.exportHeader(output)
+        if export_type == "audience":
+            self.exportSummaryHeader(output, columns)
+        else:
+            self.exportHeader(output, columns)
+
+        # get the stage of this output
+        stage = self.instrumentation.stage("export '%s'" % (file_output))
 
-        # iterate through timing
-        for timerange in time_ranges:
+        # count the exported rows
+        rows = 0
 
-            # export the item
-            self.exportTimerange(timerange, self.audience, output)
+        with stage:
+
+            # iterate through timing
+            for timerange in time_ranges:
+
+                # export the item and count the rows
+                if export_type == "audience":
+                    count = self.exportSummaryTimerange(timerange,
+                                                        self.audience, output,
+                                                        columns, threshold)
+                else:
+                    count = self.exportTimerange(timerange, self.audience,
+                                                 output, columns)
+                stage.count(count)
+                rows += count
 
         # close output file
         output.close()
 
+        # return the number of exported rows
+        return rows
+
+
+    def exportHeader(self, output, columns=COLUMNS):
 
-    def exportHeader(self, output):
+        prefixes = dict((name, prefix) for name, key, prefix in CHANNELS)
 
         # write the header
         output.write("Person, TimeFrom, TimeTo, " +
-                     "Happy_AVG, Sad_AVG, Angry_AVG, " +
-                     "Surprise_AVG, MouthOpen_AVG, Pitch_AVG, Roll_AVG, Yaw_AVG, " +
+                     "".join("%s_%s, " % (prefixes[channel],
+                                          STATISTICS[statistic])
+                             for channel, statistic in columns) +
                      "ID, Label\n")
 
 
-    def exportTimerange(self, timerange, audience, output):
+    def exportTimerange(self, timerange, audience, output, columns=COLUMNS):
 
         # get properties
-        rangeId = timerange["id"]
-        inputId = timerange["inputId"]
-
-        # parse as dates
-        fromTime = self._parseTime(timerange["from"])
-        toTime = self._parseTime(timerange["to"])
+        rangeId = timerange.id
+        inputId = timerange.inputId
 
         # get the label from the avg timing item
-        label = timerange["label"]
-
-        # loop for every sec
-
-        # init
-        datefrom = fromTime
+        label = timerange.label
 
-        while datefrom < toTime:
+        # the windows of the time range
+        starts, ends = self._windows(timerange)
 
-            # at the beginning of the loop
-            dateto = datefrom + timedelta(seconds=1)
+        # offset of the Person ids of this input
+        offset = self.offsets.get(inputId, 0)
 
-            # debug:
-            # print str(datefrom) + " - " + str(dateto)
+        # aggregate all windows of each person in one pass
+        people = audience[inputId].getValidPeople()
+        results = [person.aggregateWindows(starts, ends, columns)
+                   for person in people]
 
-            # loop body
+        rows = 0
 
-            # get the data of all people for this 1sec period
-            data = audience[inputId].getDataForTimestamp(datefrom,
-                                                         dateto)
+        # iterate through the windows
+        for index in range(len(starts)):
 
             # iterate through the people
-            for person in data:
+            for person, result in zip(people, results):
 
                 self.exportElements(rangeId,
                                     label,
-                                    datefrom,
-                                    dateto,
-                                    person["DURING"],
+                                    int(starts[index]),
+                                    int(ends[index]),
+                                    person.id + offset,
+                                    [(statistic, values[index])
+                                     for (channel, statistic), values
+                                     in zip(columns, result)],
                                     output)
+                rows += 1
 
-            # at the end of the loop
-            datefrom = dateto
+        # return the number of exported rows
+        return rows
 
 
-    def exportElements(self, rangeId, label, timeFrom, timeTo,
-                       data, output):
+    def exportSummaryHeader(self, output, columns=COLUMNS):
+
+        prefixes = dict((name, prefix) for name, key, prefix in CHANNELS)
+
+        # write the header
+        output.write("TimeFrom, TimeTo, Faces, Detections, Laughing, " +
+                     "".join("%s_%s, " % (prefixes[channel],
+                                          STATISTICS[statistic])
+                             for channel, statistic in columns) +
+                     "ID, Label\n")
+
+
+    def exportSummaryTimerange(self, timerange, audience, output,
+                               columns=COLUMNS, threshold=LAUGH_THRESHOLD):
 
         # get properties
-        person = data["id"]
-        happy = data["happy"]
-        sad = data["sad"]
-        angry = data["angry"]
-        surprised = data["surprised"]
-        mouth_open = data["mouthOpen"]
-        pitch = data["pitch"]
-        roll = data["roll"]
-        yaw = data["yaw"]
-
-        # Person, TimeFrom, TimeTo, Happy, Sad, Angry, Surprise,
-        # MouthOpen, Night, ID
-        output.write("%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s\n" %
-                     (person,
-                      timeFrom.strftime("%H:%M:%S.%f"),
-                      timeTo.strftime("%H:%M:%S.%f"),
-                      happy, sad, angry, surprised,
-                      mouth_open, pitch, roll, yaw,
-                      rangeId, label))
+        rangeId = timerange.id
+        inputId = timerange.inputId
 
+        # get the label from the avg timing item
+        label = timerange.label
 
-    def _parseDate(self, date):
-        '''Parse a date in string and return a datetime object'''
+        # the windows of the time range
+        starts, ends = self._windows(timerange)
 
-        if len(date) == 20:
-            # Datetime format: '2013-Jul-02 16:32:46'
-            value = datetime.strptime(date, '%Y-%b-%d %H:%M:%S')
-        else:
-            # Datetime format: '2013-Jul-02 16:32:46.396849'
-            value = datetime.strptime(date, '%Y-%b-%d %H:%M:%S.%f')
+        # aggregate all windows across all people in one pass
+        summary = audience[inputId].summarise(starts, ends, columns,
+                                              threshold)
 
-        return value
+        # iterate through the windows
+        for index in range(len(starts)):
 
+            values = [("count", summary["faces"][index]),
+                      ("count", summary["detections"][index]),
+                      ("mean", summary["laughing"][index])]
+            values += [(statistic, result[index])
+                       for (channel, statistic), result
+                       in zip(columns, summary["columns"])]
 
-    def _parseTime(self, time):
-        '''Parse a time in string and return a datetime object'''
+            # TimeFrom, TimeTo, Faces, Detections, Laughing, columns...
+            output.write("%s, %s, %s%s, %s\n" %
+                         (sp.formattime(int(starts[index])),
+                          sp.formattime(int(ends[index])),
+                          "".join(_formatValue(value, statistic) + ", "
+                                  for statistic, value in values),
+                          rangeId, label))
 
-        if len(time) == 8:
-            # Datetime format: '16:32:46'
-            value = datetime.strptime(time, '%H:%M:%S')
-        else:
-            # Datetime format: '16:32:46.396849'
-            value = datetime.strptime(time, '%H:%M:%S.%f')
+        # return the number of exported rows
+        return len(starts)
+
+
+    def _windows(self, timerange):
+        '''Return the starts and ends (in microseconds)
+           of the windows of a time range'''
+
+        starts = numpy.arange(timerange.fromTime, timerange.toTime,
+                              timerange.window, dtype=numpy.int64)
+
+        return starts, starts + timerange.window
+
+
+    def exportElements(self, rangeId, label, timeFrom, timeTo,
+                       person, values, output):
 
-        return value
+        # Person, TimeFrom, TimeTo, columns..., ID, Label
+        output.write("%s, %s, %s, %s%s, %s\n" %
+                     (person,
+                      sp.formattime(timeFrom),
+                      sp.formattime(timeTo),
+                      "".join(_formatValue(value, statistic) + ", "
+                              for statistic, value in values),
+                      rangeId, label))
+
+
+    def _parseTime(self, time):
+        '''Parse a time in string and return it in microseconds'''
+
+        # Time format: '16:32:46' or '16:32:46.396849'
+        return sp.parsetime(time)
 
     def distance(self, point1, point2):
         return hypot(point2[0] - point1[0], point2[1] - point1[1])
@@ -240,18 +379,21 @@ class ShoreAnalyser:
 class Audience:
     '''Audience class'''
 
-    def __init__(self, filters):
+    def __init__(self, filters, sample_rate=None):
 
         # init the list of Persons
         self._people = []
 
+        # save the rate (Hz) that detections are decimated to
+        self._sampleRate = sample_rate
+
         # init the frames counter
         self._frames = 0
         self._lastFrame = None
 
-        # init list for TimeStamp and DeltaTime
+        # init list for TimeStamp and DeltaTime (in microseconds)
         self._timestamps = []
-        self._deltatimes = []
+        self._deltatimes = array('q')
 
         # save filters
         self._filters = filters
@@ -288,7 +430,7 @@ class Audience:
         if person is None:
 
             # create the object
-            person = Person()
+            person = Person(self._sampleRate)
 
             # update it with current data
             person.update(frame, shoreDict)
@@ -300,7 +442,7 @@ class Audience:
             # just update it
             person.update(frame, shoreDict)
             #x, y = frame.center()
-            #print "x:" + str(x) + " y:" + str(y)
+            #print("x:" + str(x) + " y:" + str(y))
 
 
     def _personExists(self, shore_id, frame):
@@ -316,6 +458,45 @@ class Audience:
         return None
 
 
+    def flush(self):
+        ''' store the detections that are pending decimation '''
+
+        for person in self._people:
+            person.flush()
+
+
+    def checkpointState(self):
+        ''' the tracking state saved whole by each checkpoint '''
+
+        return {"frames": self._frames, "lastFrame": self._lastFrame}
+
+
+    def checkpointColumns(self):
+        ''' the columns whose new items are saved by each checkpoint
+            (the TimeStamps are not used by the analysis and not saved) '''
+
+        return {"deltatimes": self._deltatimes}
+
+
+    def restoreCheckpoint(self, state, columns, people):
+        ''' restore the state, the columns and the Persons
+            of a checkpoint '''
+
+        self._frames = state["frames"]
+        self._lastFrame = state["lastFrame"]
+        self._deltatimes = columns["deltatimes"]
+
+        # keep the TimeStamps aligned with the frames
+        self._timestamps = [None] * len(self._deltatimes)
+
+        self._people = []
+
+        for personState, personColumns in people:
+            person = Person(self._sampleRate)
+            person.restoreCheckpoint(personState, personColumns)
+            self._people.append(person)
+
+
     def getValidPeople(self, max_people=None):
         ''' Check the people array and only return the valid ones '''
 
@@ -332,10 +513,10 @@ class Audience:
 
     def statistics(self):
 
-        # use MutableString for efficiency
-        statistics = MutableString()
+        # collect the parts and join them once
+        statistics = []
 
-        statistics += "Frames: %d\n" % (self._frames)
+        statistics.append("Frames: %d\n" % (self._frames))
 
         # add statistics about each identified person
         for person in self.getValidPeople():
@@ -346,12 +527,14 @@ class Audience:
             percentage = int(float(person.identified) / self._frames * 100)
 
             # statistics
-            statistics += "Person_" + str(person.id) + ": "
-            statistics += str(person.identified) + " (" + str(percentage) + "%) - "
-            statistics += str(person.gender()) + " (" + str(person.age()) + ") - "
-            statistics += str(x) + "x" + str(y) + "\n"
+            statistics.append("Person_" + str(person.id) + ": ")
+            statistics.append(str(person.identified) + " (" +
+                              str(percentage) + "%) - ")
+            statistics.append(str(person.gender()) + " (" +
+                              str(person.age()) + ") - ")
+            statistics.append(str(x) + "x" + str(y) + "\n")
 
-        return str(statistics)
+        return "".join(statistics)
 
 
     def getDataForTimestamp(self, fromTime, toTime, before, after,
@@ -406,6 +589,88 @@ class Audience:
         return dataList
 
 
+    def summarise(self, starts, ends, columns, threshold=LAUGH_THRESHOLD):
+        ''' aggregate the windows [starts, ends) in microseconds across
+            all people and return arrays (one value per window) of the
+            faces, detections, laughing fraction and columns '''
+
+        people = self.getValidPeople()
+        windows = len(starts)
+
+        # one row for each channel used by the columns (happy first,
+        # for the laughing faces)
+        channels = ["happy"]
+        for channel, statistic in columns:
+            if channel not in channels:
+                channels.append(channel)
+
+        statistics = set(statistic for channel, statistic in columns)
+        statistics.add("mean")
+
+        # the samples of all people are concatenated, the windows of
+        # each person are offset by the samples of the people before
+        fromIndexes = numpy.zeros((len(people), windows), dtype=numpy.intp)
+        toIndexes = numpy.zeros((len(people), windows), dtype=numpy.intp)
+        offset = 0
+
+        for row, person in enumerate(people):
+            first, last = person.windowIndexes(starts, ends)
+            fromIndexes[row] = first + offset
+            toIndexes[row] = last + offset
+            offset += len(person._deltatime)
+
+        if people:
+            values = numpy.hstack([numpy.vstack([person._channel(channel)
+                                                 for channel in channels])
+                                   for person in people])
+            weights = numpy.hstack([numpy.vstack([person._weights(channel)
+                                                  for channel in channels])
+                                    for person in people])
+            detections = numpy.concatenate([person._weights()
+                                            for person in people])
+        else:
+            values = numpy.empty((len(channels), 0))
+            weights = numpy.empty((len(channels), 0))
+            detections = numpy.empty(0)
+
+        result = aggregate(values, weights, fromIndexes.ravel(),
+                           toIndexes.ravel(), statistics)
+
+        # statistics of each person (channels x people x windows)
+        shape = (len(channels), len(people), windows)
+        result = dict((statistic, data.reshape(shape))
+                      for statistic, data in result.items())
+
+        # faces with samples and their detections in each window
+        cumulative = numpy.concatenate([[0], numpy.cumsum(detections)])
+        faces = (toIndexes > fromIndexes).sum(axis=0)
+        detections = (cumulative[toIndexes] -
+                      cumulative[fromIndexes]).sum(axis=0)
+
+        # fraction of the faces (with a happy value) that are laughing
+        happy = result["mean"][0]
+        valid = ~numpy.isnan(happy)
+
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            laughing = ((happy >= threshold).sum(axis=0) /
+                        valid.sum(axis=0).astype(float))
+
+        # counts are summed across people, other statistics averaged
+        summary = []
+        for channel, statistic in columns:
+            values = result[statistic][channels.index(channel)]
+
+            if statistic == "count":
+                summary.append(values.sum(axis=0))
+            else:
+                summary.append(_meanAcrossPeople(values))
+
+        return {"faces": faces,
+                "detections": detections,
+                "laughing": laughing,
+                "columns": summary}
+
+
     def distance(self, point1, point2):
         return hypot(point2[0] - point1[0], point2[1] - point1[1])
 
@@ -449,7 +714,7 @@ class Person:
     '''Person class'''
     _counter = 0
 
-    def __init__(self):
+    def __init__(self, sample_rate=None):
 
         # set the id
         self.id = Person._counter
@@ -464,23 +729,28 @@ class Person:
         # init SHORE id
         self.shore_id = None
 
-        # init list structures
+        # init decimation (rate in Hz, None stores every detection)
+        self._sampleRate = sample_rate
+        self._pending = []
+        self._pendingBucket = None
+
+        # init list structures (DeltaTime in microseconds)
+        self._count = array('q')
         self._timestamp = []
-        self._deltatime = []
-        self._uptime = []
-        self._score = []
+        self._deltatime = array('q')
         self._gender = []
-        self._surprised = []
-        self._sad = []
-        self._happy = []
-        self._angry = []
-        self._age = []
-        self._mouthOpen = []
-        self._leftEyeClosed = []
-        self._rightEyeClosed = []
-        self._pitch = []
-        self._roll = []
-        self._yaw = []
+
+        # init channel arrays (NaN for missing values)
+        self._channels = dict((name, array('d'))
+                              for name, key, prefix in CHANNELS)
+
+        # init the valid detections of each channel in each sample
+        # (only decimated samples average more than one detection)
+        if sample_rate is not None:
+            self._valid = dict((name, array('q'))
+                               for name, key, prefix in CHANNELS)
+        else:
+            self._valid = None
 
 
     def update(self, frame, shoreDict):
@@ -494,23 +764,148 @@ class Person:
         # update SHORE id
         self.shore_id = shoreDict['Id']
 
+        # without decimation, store every detection
+        if self._sampleRate is None:
+            self._store(shoreDict, 1)
+            return
+
+        # store the pending detections once a new bucket starts
+        bucket = self._bucket(shoreDict['DeltaTime'])
+
+        if bucket != self._pendingBucket:
+            self.flush()
+            self._pendingBucket = bucket
+
+        self._pending.append(shoreDict)
+
+
+    def flush(self):
+        ''' store the pending detections as a single sample '''
+
+        if self._pending:
+            shoreDict, valid = self._aggregate(self._pending)
+            self._store(shoreDict, len(self._pending), valid)
+            self._pending = []
+
+
+    def checkpointState(self):
+        ''' the tracking state saved whole by each checkpoint '''
+
+        return {"id": self.id,
+                "identified": self.identified,
+                "frame": self.frame,
+                "shore_id": self.shore_id,
+                "pending": self._pending,
+                "pendingBucket": self._pendingBucket}
+
+
+    def checkpointColumns(self):
+        ''' the columns whose new items are saved by each checkpoint
+            (the TimeStamps are not used by the analysis and not saved) '''
+
+        columns = {"count": self._count,
+                   "deltatime": self._deltatime,
+                   "gender": self._gender}
+
+        for name, key, prefix in CHANNELS:
+            columns["channel " + name] = self._channels[name]
+
+            if self._valid is not None:
+                columns["valid " + name] = self._valid[name]
+
+        return columns
+
+
+    def restoreCheckpoint(self, state, columns):
+        ''' restore the state and the columns of a checkpoint '''
+
+        self.id = state["id"]
+        self.identified = state["identified"]
+        self.frame = state["frame"]
+        self.shore_id = state["shore_id"]
+        self._pending = state["pending"]
+        self._pendingBucket = state["pendingBucket"]
+
+        self._count = columns["count"]
+        self._deltatime = columns["deltatime"]
+        self._gender = columns["gender"]
+
+        for name, key, prefix in CHANNELS:
+            self._channels[name] = columns["channel " + name]
+
+            if self._valid is not None:
+                self._valid[name] = columns["valid " + name]
+
+        # keep the TimeStamps aligned with the samples
+        self._timestamp = [None] * len(self._deltatime)
+
+
+    def _bucket(self, deltatime):
+        ''' return the decimation bucket of a DeltaTime '''
+
+        return int(deltatime * self._sampleRate // 1000000)
+
+
+    def _aggregate(self, detections):
+        ''' aggregate detections into a single dictionary and return
+            it with the number of valid detections of each channel '''
+
+        # keep the timing of the first detection
+        first = detections[0]
+        shoreDict = {'TimeStamp': first.get('TimeStamp'),
+                     'DeltaTime': first.get('DeltaTime')}
+
+        valid = {}
+
+        # average the numeric values
+        for name, key, prefix in CHANNELS:
+
+            filtered = [detection[key] for detection in detections
+                        if detection.get(key) is not None]
+
+            valid[name] = len(filtered)
+
+            if len(filtered) > 0:
+                shoreDict[key] = float(sum(filtered)) / len(filtered)
+            else:
+                shoreDict[key] = None
+
+        # use the most common gender
+        genders = [detection['Gender'] for detection in detections
+                   if detection.get('Gender') is not None]
+
+        if len(genders) > 0:
+            shoreDict['Gender'] = max(set(genders), key=genders.count)
+        else:
+            shoreDict['Gender'] = None
+
+        return shoreDict, valid
+
+
+    def _store(self, shoreDict, count, valid=None):
+
+        # number of detections in this sample
+        self._count.append(count)
+
+        # number of valid detections of each channel in this sample
+        if valid is not None:
+            for name, key, prefix in CHANNELS:
+                self._valid[name].append(valid[name])
+
         # add values to buffer lists
         self._addToBuffer(shoreDict, 'TimeStamp', self._timestamp)
-        self._addToBuffer(shoreDict, 'DeltaTime', self._deltatime)
-        self._addToBuffer(shoreDict, 'Uptime', self._uptime)
-        self._addToBuffer(shoreDict, 'Score', self._score)
+        self._deltatime.append(shoreDict['DeltaTime'])
         self._addToBuffer(shoreDict, 'Gender', self._gender)
-        self._addToBuffer(shoreDict, 'Surprised', self._surprised)
-        self._addToBuffer(shoreDict, 'Sad', self._sad)
-        self._addToBuffer(shoreDict, 'Happy', self._happy)
-        self._addToBuffer(shoreDict, 'Angry', self._angry)
-        self._addToBuffer(shoreDict, 'Age', self._age)
-        self._addToBuffer(shoreDict, 'MouthOpen', self._mouthOpen)
-        self._addToBuffer(shoreDict, 'LeftEyeClosed', self._leftEyeClosed)
-        self._addToBuffer(shoreDict, 'RightEyeClosed', self._rightEyeClosed)
-        self._addToBuffer(shoreDict, 'Pitch', self._pitch)
-        self._addToBuffer(shoreDict, 'Roll', self._roll)
-        self._addToBuffer(shoreDict, 'Yaw', self._yaw)
+
+        # add values to channel arrays
+        for name, key, prefix in CHANNELS:
+
+            value = shoreDict.get(key)
+
+            if value is None:
+                value = NAN
+
+            self._channels[name].append(value)
 
 
     def _addToBuffer(self, shoreDict, dictkey, bufferlist):
@@ -547,37 +942,36 @@ class Person:
 
     def searchForIndexes(self, fromTime, toTime):
 
-        # init the indexes
-        fromIndex = None
-        toIndex = None
+        # decimated samples are in the windows [fromTime, toTime) of
+        # their bucket, as the detections they average
+        if self._sampleRate is not None:
+            return (bisect.bisect_left(self._deltatime, fromTime),
+                    bisect.bisect_left(self._deltatime, toTime))
 
-        # iterate from begin index
-        for index, item in enumerate(self._deltatime[:]):
+        # the last item <= fromTime (DeltaTime is sorted)
+        fromIndex = bisect.bisect_right(self._deltatime, fromTime) - 1
 
-            # iterate until you find an item > timestamp
-            if item <= fromTime:
-                fromIndex = index
-                toIndex = index
+        # the last item < toTime
+        toIndex = bisect.bisect_left(self._deltatime, toTime) - 1
 
-            if item < toTime:
-                toIndex = index
+        # None if there is no such item
+        if fromIndex < 0:
+            fromIndex = None
 
-            # once you find it, break
-            else:
-                break
+        if toIndex < 0:
+            toIndex = None
 
-        # return the last item
         return fromIndex, toIndex
 
 
     def searchForDeltaTimeIndex(self, deltatime):
 
-        # iterate from begin index
-        for index, item in enumerate(self._deltatime[:]):
+        # the first item >= deltatime
+        index = bisect.bisect_left(self._deltatime, deltatime)
 
-            # iterate until you find an item == timestamp
-            if item == deltatime:
-                return index
+        if index < len(self._deltatime) and \
+                self._deltatime[index] == deltatime:
+            return index
 
         # Couldn't be found
         return None
@@ -616,121 +1010,170 @@ class Person:
 
 
     def surprised(self, fromIndex, toIndex):
+        return self.statistic("surprised", fromIndex, toIndex)
 
-        filtered = filter(lambda x: x is not None,
-                          self._surprised[fromIndex:toIndex])
 
-        if len(filtered) > 0:
-            return numpy.mean(filtered)
-        else:
-            return None
+    def sad(self, fromIndex, toIndex):
+        return self.statistic("sad", fromIndex, toIndex)
 
 
-    def sad(self, fromIndex, toIndex):
+    def happy(self, fromIndex, toIndex):
+        return self.statistic("happy", fromIndex, toIndex)
 
-        filtered = filter(lambda x: x is not None,
-                          self._sad[fromIndex:toIndex])
 
-        if len(filtered) > 0:
-            return numpy.mean(filtered)
-        else:
-            return None
+    def angry(self, fromIndex, toIndex):
+        return self.statistic("angry", fromIndex, toIndex)
 
 
-    def happy(self, fromIndex, toIndex):
+    def pitch(self, fromIndex, toIndex):
+        return self.statistic("pitch", fromIndex, toIndex)
 
-        filtered = filter(lambda x: x is not None,
-                          self._happy[fromIndex:toIndex])
 
-        if len(filtered) > 0:
-            return numpy.mean(filtered)
-        else:
-            return None
+    def roll(self, fromIndex, toIndex):
+        return self.statistic("roll", fromIndex, toIndex)
 
 
-    def angry(self, fromIndex, toIndex):
+    def yaw(self, fromIndex, toIndex):
+        return self.statistic("yaw", fromIndex, toIndex)
 
-        filtered = filter(lambda x: x is not None,
-                          self._angry[fromIndex:toIndex])
 
-        if len(filtered) > 0:
-            return numpy.mean(filtered)
-        else:
-            return None
+    def mouthOpen(self, fromIndex, toIndex):
+        return self.statistic("mouthOpen", fromIndex, toIndex)
 
 
-    def pitch(self, fromIndex, toIndex):
+    def gender(self):
 
-        filtered = filter(lambda x: x is not None,
-                          self._pitch[fromIndex:toIndex])
+        filtered = [x for x in self._gender if x is not None]
 
         if len(filtered) > 0:
-            return numpy.mean(filtered)
+
+            count_male = filtered.count("Male")
+            count_female = filtered.count("Female")
+
+            if count_male > count_female:
+                return "Male"
+            else:
+                return "Female"
+
         else:
             return None
 
 
-    def roll(self, fromIndex, toIndex):
+    def age(self):
+        return self.statistic("age", None, None)
 
-        filtered = filter(lambda x: x is not None,
-                          self._roll[fromIndex:toIndex])
 
-        if len(filtered) > 0:
-            return numpy.mean(filtered)
-        else:
+    def statistic(self, channel, fromIndex, toIndex, statistic="mean"):
+        ''' statistic of a channel in the index range (None if there
+            are no values), weighted by the valid detections of each
+            sample '''
+
+        values = self._channel(channel)[fromIndex:toIndex]
+        weights = self._weights(channel)[fromIndex:toIndex]
+
+        result = aggregate(values[numpy.newaxis], weights,
+                           [0], [len(values)], [statistic])[statistic][0, 0]
+
+        if numpy.isnan(result):
             return None
 
+        return result
 
-    def yaw(self, fromIndex, toIndex):
 
-        filtered = filter(lambda x: x is not None,
-                          self._yaw[fromIndex:toIndex])
+    def aggregateWindows(self, starts, ends, columns):
+        ''' aggregate the windows [starts, ends) in microseconds and
+            return an array (one value per window) for each column '''
+
+        # same indexes as searchForIndexes, for all windows at once
+        if self._sampleRate is not None:
+            fromIndexes, toIndexes = self.windowIndexes(starts, ends)
 
-        if len(filtered) > 0:
-            return numpy.mean(filtered)
         else:
-            return None
+            deltatime = numpy.frombuffer(self._deltatime,
+                                         dtype=numpy.int64)
+
+            fromIndexes = numpy.searchsorted(deltatime, starts,
+                                             side='right') - 1
+            toIndexes = numpy.searchsorted(deltatime, ends, side='left') - 1
+
+            # None indexes slice from the beginning or to the end
+            fromIndexes[fromIndexes < 0] = 0
+            toIndexes[toIndexes < 0] = len(deltatime)
+
+        # one row for each channel used by the columns
+        channels = []
+        for channel, statistic in columns:
+            if channel not in channels:
+                channels.append(channel)
+
+        # only aggregate the samples covered by the windows
+        if len(fromIndexes):
+            first = int(min(fromIndexes.min(), toIndexes.min()))
+            last = int(max(fromIndexes.max(), toIndexes.max()))
+        else:
+            first = last = 0
 
+        values = numpy.vstack([self._channel(channel)[first:last]
+                               for channel in channels])
+        weights = numpy.vstack([self._weights(channel)[first:last]
+                                for channel in channels])
+        statistics = set(statistic for channel, statistic in columns)
 
-    def mouthOpen(self, fromIndex, toIndex):
+        result = aggregate(values, weights, fromIndexes - first,
+                           toIndexes - first, statistics)
 
-        filtered = filter(lambda x: x is not None,
-                          self._mouthOpen[fromIndex:toIndex])
+        return [result[statistic][channels.index(channel)]
+                for channel, statistic in columns]
 
-        if len(filtered) > 0:
-            return numpy.mean(filtered)
-        else:
-            return None
 
+    def windowIndexes(self, starts, ends):
+        ''' indexes [from, to) of the samples in the windows [starts, ends)
+            in microseconds (empty windows have from == to) '''
 
-    def gender(self):
+        deltatime = numpy.frombuffer(self._deltatime, dtype=numpy.int64)
 
-        filtered = filter(lambda x: x is not None,
-                          self._gender[:])
+        return (numpy.searchsorted(deltatime, starts, side='left'),
+                numpy.searchsorted(deltatime, ends, side='left'))
 
-        if len(filtered) > 0:
 
-            count_male = filtered.count("Male")
-            count_female = filtered.count("Female")
+    def _channel(self, channel):
+        ''' the values of a channel as an array (no copy) '''
 
-            if count_male > count_female:
-                return "Male"
-            else:
-                return "Female"
+        return numpy.frombuffer(self._channels[channel], dtype=float)
 
-        else:
-            return None
 
+    def _weights(self, channel=None):
+        ''' the number of detections of each sample, or the number of
+            valid detections of a channel in each sample (no copy) '''
 
-    def age(self):
+        # without decimation, every valid value is a single detection
+        if channel is None or self._valid is None:
+            return numpy.frombuffer(self._count, dtype=numpy.int64)
 
-        filtered = filter(lambda x: x is not None,
-                          self._age[:])
+        return numpy.frombuffer(self._valid[channel], dtype=numpy.int64)
 
-        if len(filtered) > 0:
-            return numpy.mean(filtered)
-        else:
-            return None
+
+def _formatValue(value, statistic):
+    '''Format an exported value (None for missing values)'''
+
+    if numpy.isnan(value):
+        return "None"
+
+    if statistic == "count":
+        return "%d" % (value)
+
+    return "%s" % (value)
+
+
+def _meanAcrossPeople(values):
+    '''Mean of the columns of a 2D array (people x windows),
+       ignoring NaN (NaN if a column has no values)'''
+
+    valid = ~numpy.isnan(values)
+    total = numpy.where(valid, values, 0.0).sum(axis=0)
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return total / valid.sum(axis=0)
 
 
 class Frame:
@@ -753,49 +1196,89 @@ class Frame:
     def center(self):
 
         # calculate middle point of X and Y
-        midX = self.left + self.width() / 2
-        midY = self.top + self.height() / 2
+        midX = self.left + self.width() // 2
+        midY = self.top + self.height() // 2
 
         return midX, midY
 
 
-''' main '''
-if __name__ == '__main__':
-
-    # check if the the input filename exists as a parameter
-    if len(sys.argv) < 2:
-        sys.exit('Missing input file')
+def run(configuration, resume=False):
+    '''Analyse the inputs and export the outputs of a configuration
+       (resume continues the analyses from their checkpoints)'''
 
-    # read configuration file from arguments
-    inputFile = sys.argv[1]
+    # validate the whole configuration before analysing anything
+    configuration = sc.compileConfiguration(configuration)
 
-    # open configuration source file
-    conf_source = open(inputFile, 'r')
+    output_report = configuration.output_report
 
-    # convert json file to python object
-    configuration = json.loads(conf_source.read())
-
-    # close configuration source file
-    conf_source.close()
-
-    # get the inputs from the configuration file
-    conf_inputs = configuration["inputs"]
+    # only record timings if a report is requested
+    instrumentation = Instrumentation(enabled=output_report is not None)
 
     # init the Comedy Analyser with given inputs
-    analyser = ShoreAnalyser(conf_inputs)
+    analyser = ShoreAnalyser(configuration.inputs, instrumentation, resume)
 
     # Use ShoreAnalyser to produce the outputs
     # using the configuration as a guidance
     # -----------------------------------------
 
     # iterate through items in configuration json file
-    for conf_item in configuration["configurations"]:
+    for conf_item in configuration.configurations:
 
-        print "Exporting to '%s'.." % (conf_item["output"])
+        print("Exporting to '%s'.." % (conf_item.output))
 
         # export the output files
         analyser.export(conf_item)
 
-        print "Exporting completed!"
+        print("Exporting completed!")
+
+    # write the report file
+    if output_report is not None:
+
+        print(instrumentation.report())
+        print("Exporting report file '%s'." % (output_report))
+
+        instrumentation.write(output_report)
+
+
+''' main '''
+if __name__ == '__main__':
 
-    print "ShoreAnalyser is complete."
+    parser = argparse.ArgumentParser(
+        description='Analyse SHORE log files and export them to CSV.')
+    parser.add_argument('configuration',
+                        help='configuration file (JSON)')
+    parser.add_argument('--profile', metavar='PREFIX',
+                        help='profile the analysis and write '
+                             'PREFIX.txt and PREFIX.folded')
+    parser.add_argument('--profiler', default='auto',
+                        choices=['auto', 'sampling', 'cprofile'],
+                        help='profiler used by --profile (default: auto, '
+                             'sampling when available)')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue the analyses from their checkpoints')
+    args = parser.parse_args()
+
+    # load and validate the configuration file
+    try:
+        configuration = sc.load(args.configuration)
+    except sc.ConfigurationError as error:
+        sys.exit('Error: ' + str(error))
+
+    # run from the imported module, so that checkpoints refer to
+    # ShoreAnalyser.Frame (readable by any process) and not __main__
+    import ShoreAnalyser
+
+    if args.profile is not None:
+
+        # run the analysis under the profiler
+        profiler = Profiler(args.profile, args.profiler)
+        profiler.runcall(ShoreAnalyser.run, configuration, args.resume)
+
+        report, folded = profiler.write()
+        print("Profile (%s) written to '%s' and '%s'." %
+              (profiler.mode, report, folded))
+
+    else:
+        ShoreAnalyser.run(configuration, args.resume)
+
+    print("ShoreAnalyser is complete.")
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+
+#  Batch runner for many ShoreAnalyser configurations.
+#  Copyright (c) 2013 Queen Mary University of London. All rights reserved.
+
+import os
+import sys
+import copy
+import json
+import argparse
+
+from timeit import default_timer as timer
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import ShoreAnalyser as sa
+import ShoreConfiguration as sc
+from ShoreInstrumentation import Instrumentation
+
+
+class Job:
+    '''Job class (a configuration file)'''
+
+    def __init__(self, filename, configuration):
+
+        # save the properties
+        self.filename = filename
+        self.configuration = configuration
+
+        # keys of the analysis tasks, in order of the inputs
+        self.keys = [inputKey(conf_input)
+                     for conf_input in configuration.inputs]
+
+        # state
+        self.submitted = False
+        self.failed = False
+
+
+class Batch:
+    '''Batch class
+
+       Analyses the inputs of many configuration files once (shared inputs
+       are analysed only once) and exports their outputs, scheduling the
+       analysis and export tasks on a process pool.'''
+
+    def __init__(self, conf_files, jobs=None, resume=False):
+
+        # load and validate the configurations before running anything
+        self.jobs = []
+        self.invalid = []
+
+        for conf_file in conf_files:
+            try:
+                configuration = sc.load(conf_file)
+            except sc.ConfigurationError as error:
+                print("Invalid configuration '%s': %s" % (conf_file, error))
+                self.invalid.append(conf_file)
+                continue
+
+            self.jobs.append(Job(conf_file, configuration))
+
+        # de-duplicate the inputs (key -> conf_input)
+        self.inputs = {}
+        self.logs = {}
+
+        for job in self.jobs:
+            for key, conf_input in zip(job.keys, job.configuration.inputs):
+
+                if key not in self.inputs:
+                    self.inputs[key] = conf_input
+                    self.logs[key] = []
+
+                # every requested log file is written
+                log = conf_input.output_log
+                if log is not None and log not in self.logs[key]:
+                    self.logs[key].append(log)
+
+        # save the number of processes
+        self.processes = jobs
+
+        # resume the analyses from their checkpoints
+        self.resume = resume
+
+
+    def run(self):
+        ''' run all tasks and return the number of failed jobs '''
+
+        self._start = timer()
+
+        # state of the analyses (True once analysed, False if failed),
+        # the audiences and their number of people (by key)
+        self._analyses = {}
+        self._audiences = {}
+        self._people = {}
+
+        # number of jobs not scheduled yet that use each input, the
+        # audience is dropped once the last of them is scheduled
+        self._waiting = dict((key, 0) for key in self.inputs)
+
+        for job in self.jobs:
+            for key in set(job.keys):
+                self._waiting[key] += 1
+
+        # counters
+        self._lines = 0
+        self._rows = 0
+        self._completed = 0
+        self._failed = len(self.invalid)
+
+        print("Batch: %d jobs, %d unique inputs (%d referenced)" %
+              (len(self.jobs), len(self.inputs),
+               sum(len(job.keys) for job in self.jobs)))
+
+        with ProcessPoolExecutor(max_workers=self.processes,
+                                 initializer=_silence) as executor:
+
+            # submit the analysis tasks (no dependencies)
+            self._running = {}
+
+            for key, conf_input in self.inputs.items():
+                future = executor.submit(_analyse, conf_input, self.logs[key],
+                                         self.resume)
+                self._running[future] = ("analyse", key)
+
+            # jobs without inputs are ready
+            for job in self.jobs:
+                self._schedule(executor, job)
+
+            while self._running:
+
+                done, _ = wait(self._running.keys(),
+                               return_when=FIRST_COMPLETED)
+
+                for future in done:
+
+                    task, item = self._running.pop(future)
+
+                    if task == "analyse":
+                        self._analysed(executor, item, future)
+                    else:
+                        self._exported(item, future)
+
+        seconds = timer() - self._start
+
+        print("Batch completed in %.1fs: %d lines (%.0f lines/s), "
+              "%d rows (%.0f rows/s), %d failed jobs" %
+              (seconds, self._lines, _rate(self._lines, seconds),
+               self._rows, _rate(self._rows, seconds), self._failed))
+
+        return self._failed
+
+
+    def _analysed(self, executor, key, future):
+        ''' handle a finished analysis task '''
+
+        filename = self.inputs[key].filename
+
+        if future.exception() is not None:
+            print("Failed to analyse '%s': %s" %
+                  (filename, future.exception()))
+            self._analyses[key] = False
+
+        else:
+            audience, lines, seconds = future.result()
+
+            self._analyses[key] = True
+            self._audiences[key] = audience
+            self._people[key] = len(audience._people)
+            self._lines += lines
+
+            print("Analysed '%s' (%d lines in %.1fs, %.0f lines/s)" %
+                  (filename, lines, seconds, _rate(lines, seconds)))
+
+        # schedule the jobs that depend on this input
+        for job in self.jobs:
+            if key in job.keys:
+                self._schedule(executor, job)
+
+
+    def _exported(self, job, future):
+        ''' handle a finished export task (all outputs of a job) '''
+
+        if future.exception() is not None:
+            print("Failed to export '%s': %s" %
+                  (job.filename, future.exception()))
+            job.failed = True
+
+        else:
+            for output, rows, seconds, error in future.result():
+
+                if error is not None:
+                    print("Failed to export '%s': %s" % (output, error))
+                    job.failed = True
+
+                else:
+                    self._rows += rows
+
+                    print("Exported '%s' (%d rows in %.1fs)" %
+                          (output, rows, seconds))
+
+        self._complete(job)
+
+
+    def _schedule(self, executor, job):
+        ''' submit the export task of a job once all its inputs
+            are analysed '''
+
+        # already submitted or not ready
+        if job.submitted or any(key not in self._analyses
+                                for key in job.keys):
+            return
+
+        job.submitted = True
+
+        # a failed input fails the job
+        if not all(self._analyses[key] for key in job.keys):
+            job.failed = True
+            self._complete(job)
+            self._release(job)
+            return
+
+        # Person ids continue across the inputs of a configuration,
+        # as in a single ShoreAnalyser run
+        offsets = {}
+        offset = 0
+
+        for key, conf_input in zip(job.keys, job.configuration.inputs):
+            offsets[conf_input.id] = (key, offset)
+            offset += self._people[key]
+
+        # only send the audiences used by the outputs, once for all
+        # the outputs of the job
+        selected = {}
+
+        for conf_item in job.configuration.configurations:
+            for timerange in conf_item.time_ranges:
+                key, offset = offsets[timerange.inputId]
+                selected[timerange.inputId] = (self._audiences[key], offset)
+
+        # nothing to export
+        if not job.configuration.configurations:
+            self._complete(job)
+
+        else:
+            future = executor.submit(_export,
+                                     job.configuration.configurations,
+                                     selected)
+            self._running[future] = ("export", job)
+
+        self._release(job)
+
+
+    def _release(self, job):
+        ''' drop the audiences that no other job waits for '''
+
+        for key in set(job.keys):
+
+            self._waiting[key] -= 1
+
+            if self._waiting[key] == 0:
+                self._audiences.pop(key, None)
+
+
+    def _complete(self, job):
+
+        self._completed += 1
+
+        if job.failed:
+            self._failed += 1
+
+        print("[%d/%d] '%s' %s (%.1fs)" %
+              (self._completed, len(self.jobs), job.filename,
+               "failed" if job.failed else "completed",
+               timer() - self._start))
+
+
+def inputKey(conf_input):
+    '''Return the key of an input: inputs with the same key
+       produce the same Audience'''
+
+    # the start_date is already corrected by the start_frame, and each
+    # checkpoint file is written (and resumed) by its own analysis
+    if conf_input.checkpoint is not None:
+        checkpoint = os.path.abspath(conf_input.checkpoint)
+    else:
+        checkpoint = None
+
+    properties = {"filename": os.path.abspath(conf_input.filename),
+                  "start_date": conf_input.start_date.isoformat(),
+                  "filters": conf_input.filters,
+                  "sample_rate": conf_input.sample_rate,
+                  "checkpoint": checkpoint,
+                  "checkpoint_interval": conf_input.checkpoint_interval}
+
+    return json.dumps(properties, sort_keys=True)
+
+
+def _analyse(conf_input, logs, resume=False):
+    '''Analyse an input (in a worker process)'''
+
+    # number Persons from 0, as in a new ShoreAnalyser run
+    sa.Person._counter = 0
+
+    instrumentation = Instrumentation()
+    analyser = sa.ShoreAnalyser([], instrumentation, resume)
+
+    # the logs are written below
+    conf_input = copy.copy(conf_input)
+    conf_input.output_log = None
+
+    audience = analyser.analyseInput(conf_input)
+
+    if logs:
+        statistics = audience.statistics()
+        for log in logs:
+            with open(log, "w") as logfile:
+                logfile.write(statistics)
+
+    parse = instrumentation.stages()[0]
+
+    return audience, parse.items, sum(stage.seconds for stage in
+                                      instrumentation.stages())
+
+
+def _export(conf_items, selected):
+    '''Export the outputs of a job (in a worker process) and return
+       (output, rows, seconds, error) for each output'''
+
+    analyser = sa.ShoreAnalyser([])
+
+    # the same Audience may serve several inputs, so the Person ids
+    # of each input are shifted when exported
+    for inputId, (audience, offset) in selected.items():
+        analyser.audience[inputId] = audience
+        analyser.offsets[inputId] = offset
+
+    results = []
+
+    for conf_item in conf_items:
+
+        start = timer()
+
+        # a failed output does not stop the other outputs
+        try:
+            rows = analyser.export(conf_item)
+            results.append((conf_item.output, rows, timer() - start, None))
+        except Exception as error:
+            results.append((conf_item.output, 0, timer() - start,
+                            str(error)))
+
+    return results
+
+
+def _silence():
+    '''Silence the output of worker processes'''
+
+    sys.stdout = open(os.devnull, 'w')
+
+
+def _rate(count, seconds):
+
+    if seconds > 0:
+        return count / seconds
+    else:
+        return 0.0
+
+
+''' main '''
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Run many ShoreAnalyser configurations, analysing '
+                    'shared inputs only once.')
+    parser.add_argument('configurations', nargs='+',
+                        help='configuration files (JSON)')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='number of worker processes '
+                             '(default: number of CPUs)')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue the analyses from their checkpoints')
+    args = parser.parse_args()
+
+    batch = Batch(args.configurations, args.jobs, args.resume)
+
+    if batch.run():
+        sys.exit(1)
@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+
+#  Benchmark suite for ShoreParser and ShoreAnalyser.
+#  Copyright (c) 2013 Queen Mary University of London. All rights reserved.
+
+import os
+import sys
+import json
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+
+from timeit import default_timer as timer
+from datetime import timedelta
+from datetime import datetime
+
+import ShoreParser as sp
+import ShoreAnalyser as sa
+
+
+# Start date used by the synthetic logs (same format as configuration.json)
+START_DATE = "2015-Jun-17 13:24:30.310070"
+
+# ShoreAnalyser.py entry point next to this file
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      "ShoreAnalyser.py")
+
+# Stages reported by the benchmark
+STAGES = ['parse', 'track', 'export', 'end_to_end', 'legacy']
+
+# Distance between the centers of neighbouring faces. Person.isCloseTo
+# matches centers closer than 300 x 200 (coordinates are scaled by 1000)
+SPACING = (0.35, 0.25)
+
+# Faces per row of the grid
+COLUMNS = 3
+
+# Emotion / head pose channels written for every face
+EMOTIONS = ['Surprised', 'Sad', 'Happy', 'Angry']
+
+
+def generate(filename, duration=60, fps=29.97, faces=5, missing=0.05,
+             churn=0.001, seed=0):
+    '''Generate a synthetic SHORE log file and return the number of lines.
+
+       duration: length of the recording in seconds
+       fps:      frames per second of the recording
+       faces:    number of faces per frame
+       missing:  probability of a field being 'nil' (or empty for Gender)
+       churn:    probability per frame that a face gets a new SHORE Id'''
+
+    # use a private generator so that logs are reproducible
+    rand = random.Random(seed)
+
+    # parse the start date
+    start_date = sp._parsedate(START_DATE)
+
+    # place faces on a grid wider than the match box of the tracker,
+    # so that every face is tracked as a separate Person
+    people = []
+    for index in range(faces):
+
+        # normalized center of the face (rows continue below the frame
+        # when there are more faces than fit in it)
+        x = 0.15 + SPACING[0] * (index % COLUMNS)
+        y = 0.15 + SPACING[1] * (index // COLUMNS)
+
+        people.append({"id": index,
+                       "x": x,
+                       "y": y,
+                       "gender": rand.choice(['Male', 'Female']),
+                       "age": rand.uniform(18, 70),
+                       "uptime": 0.0})
+
+    # next available SHORE Id
+    next_id = faces
+
+    # total number of frames
+    frames = int(duration * fps)
+
+    # open file
+    output = open(filename, 'w')
+
+    lines = 0
+
+    for frame in range(frames):
+
+        # the timestamp of the frame
+        timestamp = start_date + timedelta(seconds=frame / fps)
+        stamp = timestamp.strftime('%Y-%b-%d %H:%M:%S.%f')
+
+        for person in people:
+
+            # id churn: SHORE lost the face and found it again
+            if rand.random() < churn:
+                person["id"] = next_id
+                person["uptime"] = 0.0
+                next_id += 1
+
+            person["uptime"] += 1.0 / fps
+
+            # jitter the position of the face
+            x = person["x"] + rand.uniform(-0.005, 0.005)
+            y = person["y"] + rand.uniform(-0.005, 0.005)
+
+            items = ["TimeStamp=" + stamp,
+                     "Frame=%d" % (frame),
+                     "Left=%.6f" % (x - 0.04),
+                     "Top=%.6f" % (y - 0.06),
+                     "Right=%.6f" % (x + 0.04),
+                     "Bottom=%.6f" % (y + 0.06),
+                     "Id=%d" % (person["id"])]
+
+            # Gender is written empty when missing
+            if rand.random() < missing:
+                items.append("Gender=")
+            else:
+                items.append("Gender=" + person["gender"])
+
+            for key in EMOTIONS:
+                items.append(_item(rand, missing, key,
+                                   "%.1f" % (rand.uniform(0, 100))))
+
+            items.append(_item(rand, missing, "Age",
+                               "%.1f" % (person["age"])))
+            items.append(_item(rand, missing, "MouthOpen",
+                               "%.1f" % (rand.uniform(0, 100))))
+            items.append(_item(rand, missing, "LeftEyeClosed",
+                               "%.1f" % (rand.uniform(0, 100))))
+            items.append(_item(rand, missing, "RightEyeClosed",
+                               "%.1f" % (rand.uniform(0, 100))))
+
+            for key in ['Roll', 'Yaw', 'Pitch']:
+                items.append(_item(rand, missing, key,
+                                   "%d" % (rand.randint(-30, 30))))
+
+            # never missing, so they always close the line
+            items.append("Uptime=%.3f" % (person["uptime"]))
+            items.append("Score=%.3f" % (rand.uniform(0.5, 1.0)))
+
+            output.write(" ".join(items) + "\n")
+            lines += 1
+
+    # close file
+    output.close()
+
+    return lines
+
+
+def _item(rand, missing, key, value):
+    '''Return a key=value item, or key=nil with the given probability'''
+
+    if rand.random() < missing:
+        return key + "=nil"
+    else:
+        return key + "=" + value
+
+
+def benchmark_parse(filename, start_date, repeat=3):
+    '''Benchmark ShoreParser.parseline and return the results'''
+
+    # read the lines in memory so that disk I/O is not measured
+    with open(filename, 'r') as source:
+        lines = source.readlines()
+
+    best = None
+
+    for _ in range(repeat):
+
+        start = timer()
+
+        for line in lines:
+            sp.parseline(line, start_date)
+
+        elapsed = timer() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return _result("lines", len(lines), best)
+
+
+def benchmark_track(filename, start_date, repeat=3):
+    '''Benchmark Audience.read and return the results'''
+
+    # parse the file up front so that only tracking is measured
+    measurements = sp.parsefile(filename, start_date)
+
+    best = None
+
+    for _ in range(repeat):
+
+        audience = sa.Audience(None)
+
+        start = timer()
+
+        for measurement in measurements:
+            audience.read(measurement)
+
+        elapsed = timer() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return _result("detections", len(measurements), best)
+
+
+def benchmark_export(filename, duration, repeat=3):
+    '''Benchmark ShoreAnalyser.export and return the results'''
+
+    # analyse the log once (output is silenced)
+    conf_input = {"id": "1",
+                  "filename": filename,
+                  "start_date": START_DATE}
+
+    with _Silence():
+        analyser = sa.ShoreAnalyser([conf_input])
+
+    # temporary output file
+    handle, output = tempfile.mkstemp(suffix=".csv")
+    os.close(handle)
+
+    conf_item = {"output": output,
+                 "time_ranges": [{"id": "Benchmark",
+                                  "inputId": "1",
+                                  "from": "00:00:00.000",
+                                  "to": _formattime(duration),
+                                  "label": "ALL"}]}
+
+    best = None
+
+    try:
+        for _ in range(repeat):
+
+            start = timer()
+
+            analyser.export(conf_item)
+
+            elapsed = timer() - start
+
+            if best is None or elapsed < best:
+                best = elapsed
+
+        # count the exported rows (without the header)
+        with open(output, 'r') as source:
+            rows = sum(1 for _ in source) - 1
+
+    finally:
+        os.remove(output)
+
+    return _result("rows", rows, best)
+
+
+def benchmark_end_to_end(filename, duration, repeat=3,
+                         interpreter=None, script=SCRIPT):
+    '''Benchmark a complete run of the ShoreAnalyser.py entry point
+       (including interpreter start-up) and return the results'''
+
+    if interpreter is None:
+        interpreter = sys.executable
+
+    workdir = tempfile.mkdtemp()
+
+    # configuration of the run
+    configuration = {"inputs": [{"id": "1",
+                                 "filename": os.path.abspath(filename),
+                                 "start_date": START_DATE}],
+                     "configurations": [{"output": "output.csv",
+                                         "time_ranges": [
+                                             {"id": "Benchmark",
+                                              "inputId": "1",
+                                              "from": "00:00:00.000",
+                                              "to": _formattime(duration),
+                                              "label": "ALL"}]}]}
+
+    conf_file = os.path.join(workdir, "configuration.json")
+    with open(conf_file, 'w') as output:
+        json.dump(configuration, output)
+
+    # count the lines of the log
+    with open(filename, 'r') as source:
+        lines = sum(1 for _ in source)
+
+    best = None
+
+    try:
+        with open(os.devnull, 'w') as devnull:
+            for _ in range(repeat):
+
+                start = timer()
+
+                code = subprocess.call([interpreter, script, conf_file],
+                                       stdout=devnull, cwd=workdir)
+
+                elapsed = timer() - start
+
+                if code != 0:
+                    raise RuntimeError("'%s %s' failed with exit code %d" %
+                                       (interpreter, script, code))
+
+                if best is None or elapsed < best:
+                    best = elapsed
+
+    finally:
+        for name in os.listdir(workdir):
+            os.remove(os.path.join(workdir, name))
+        os.rmdir(workdir)
+
+    return _result("lines", lines, best)
+
+
+def run(settings, repeat=3, workdir=None, legacy=None,
+        legacy_interpreter="python2"):
+    '''Generate a synthetic log, run all benchmarks and
+       return the results as a dictionary.
+
+       legacy: ShoreAnalyser.py of a legacy version, run end-to-end
+               with legacy_interpreter for comparison'''
+
+    # temporary log file
+    handle, filename = tempfile.mkstemp(suffix=".log", dir=workdir)
+    os.close(handle)
+
+    try:
+        lines = generate(filename, **settings)
+
+        start_date = sp._parsedate(START_DATE)
+
+        results = {"date": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                   "python": platform.python_version(),
+                   "platform": platform.platform(),
+                   "settings": settings,
+                   "lines": lines,
+                   "repeat": repeat,
+                   "parse": benchmark_parse(filename, start_date, repeat),
+                   "track": benchmark_track(filename, start_date, repeat),
+                   "export": benchmark_export(filename, settings["duration"],
+                                              repeat),
+                   "end_to_end": benchmark_end_to_end(filename,
+                                                      settings["duration"],
+                                                      repeat)}
+
+        if legacy is not None:
+            results["legacy"] = benchmark_end_to_end(filename,
+                                                     settings["duration"],
+                                                     repeat,
+                                                     legacy_interpreter,
+                                                     legacy)
+
+    finally:
+        os.remove(filename)
+
+    return results
+
+
+def compare(results, previous):
+    '''Return a text report comparing two benchmark results'''
+
+    report = ""
+
+    for stage in STAGES:
+
+        # skip stages missing from one of the runs
+        if stage not in results or stage not in previous:
+            continue
+
+        current = results[stage]["per_second"]
+        before = previous[stage]["per_second"]
+
+        if before:
+            ratio = current / before
+        else:
+            ratio = float('inf')
+
+        report += "%-10s: %12.1f %s/s (was %12.1f, x%.2f)\n" % \
+            (stage, current, results[stage]["unit"], before, ratio)
+
+    return report
+
+
+def _result(unit, count, seconds):
+    '''Return the result dictionary of a benchmark'''
+
+    if seconds > 0:
+        per_second = count / seconds
+    else:
+        per_second = float('inf')
+
+    return {"unit": unit,
+            "count": count,
+            "seconds": seconds,
+            "per_second": per_second}
+
+
+def _formattime(seconds):
+    '''Format seconds as a time range string ('00:01:00.000')'''
+
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+
+    return "%02d:%02d:%06.3f" % (hours, minutes, seconds)
+
+
+class _Silence:
+    '''Context manager that silences stdout'''
+
+    def __enter__(self):
+        self._stdout = sys.stdout
+        self._devnull = open(os.devnull, 'w')
+        sys.stdout = self._devnull
+
+    def __exit__(self, *args):
+        sys.stdout = self._stdout
+        self._devnull.close()
+
+
+''' main '''
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark ShoreParser and ShoreAnalyser '
+                    'using a synthetic SHORE log.')
+    parser.add_argument('--duration', type=int, default=60,
+                        help='duration of the log in seconds (default: 60)')
+    parser.add_argument('--fps', type=float, default=29.97,
+                        help='frames per second (default: 29.97)')
+    parser.add_argument('--faces', type=int, default=5,
+                        help='faces per frame (default: 5)')
+    parser.add_argument('--missing', type=float, default=0.05,
+                        help='probability of a nil field (default: 0.05)')
+    parser.add_argument('--churn', type=float, default=0.001,
+                        help='probability of a new SHORE Id per face '
+                             'and frame (default: 0.001)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed (default: 0)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='repetitions, best time is kept (default: 3)')
+    parser.add_argument('--output',
+                        help='save the results as JSON to this file')
+    parser.add_argument('--compare',
+                        help='compare with results of a previous run')
+    parser.add_argument('--generate',
+                        help='only generate the synthetic log to this file')
+    parser.add_argument('--legacy', metavar='SCRIPT',
+                        help='also run this (legacy) ShoreAnalyser.py '
+                             'end-to-end for comparison')
+    parser.add_argument('--legacy-interpreter', default='python2',
+                        help='interpreter of --legacy (default: python2)')
+    args = parser.parse_args()
+
+    settings = {"duration": args.duration,
+                "fps": args.fps,
+                "faces": args.faces,
+                "missing": args.missing,
+                "churn": args.churn,
+                "seed": args.seed}
+
+    # only generate the log file
+    if args.generate:
+        lines = generate(args.generate, **settings)
+        print("Generated '%s' (%d lines)." % (args.generate, lines))
+        sys.exit()
+
+    print("Running benchmarks..")
+
+    results = run(settings, args.repeat, legacy=args.legacy,
+                  legacy_interpreter=args.legacy_interpreter)
+
+    for stage in STAGES:
+
+        if stage not in results:
+            continue
+
+        print("%-10s: %12.1f %s/s (%d %s in %.3fs)" %
+              (stage,
+               results[stage]["per_second"], results[stage]["unit"],
+               results[stage]["count"], results[stage]["unit"],
+               results[stage]["seconds"]))
+
+    # compare with the legacy version
+    if "legacy" in results:
+        print("End-to-end speed-up over legacy: x%.2f" %
+              (results["legacy"]["seconds"] /
+               results["end_to_end"]["seconds"]))
+
+    # compare with a previous run
+    if args.compare:
+        with open(args.compare, 'r') as source:
+            previous = json.load(source)
+        print("Comparison with '%s':" % (args.compare))
+        print(compare(results, previous))
+
+    # save the results
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=4, sort_keys=True)
+        print("Results saved to '%s'." % (args.output))
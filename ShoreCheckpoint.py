@@ -0,0 +1,249 @@
+#  Checkpoints of long analyses.
+#  Copyright (c) 2013 Queen Mary University of London. All rights reserved.
+
+import os
+import struct
+import pickle
+
+from timeit import default_timer as timer
+
+
+# Seconds between checkpoints
+INTERVAL = 300
+
+# Lines read between two checks of the clock
+LINES = 1000
+
+# Version of the checkpoint files
+VERSION = 2
+
+# Length prefix of each record
+LENGTH = struct.Struct('<Q')
+
+
+class Checkpoint:
+    '''Checkpoint class
+
+       Periodically saves the state of the analysis of a log (the offset
+       of the next line, the Audience and the Person ids) so that an
+       interrupted analysis can resume from it.
+
+       The file is append-only: a header, then one record per checkpoint
+       with the tracking state and only the items appended to the
+       columns of the Audience and its Persons since the last record.'''
+
+    def __init__(self, filename, fingerprint, interval=INTERVAL):
+
+        # save the properties
+        self.filename = filename
+        self.fingerprint = fingerprint
+        self.interval = interval
+
+        # saved length of each column (None until the header is written)
+        self._saved = None
+
+        # end of the last complete record
+        self._end = 0
+
+        # init the counters
+        self._lines = 0
+        self._last = timer()
+
+
+    def due(self):
+        ''' return True when a checkpoint should be saved
+            (called once for every line) '''
+
+        self._lines += 1
+
+        # only check the clock from time to time
+        if self._lines < LINES:
+            return False
+
+        self._lines = 0
+
+        return timer() - self._last >= self.interval
+
+
+    def save(self, offset, audience, ids):
+        ''' append a record of the state (ids are the first Person id of
+            this analysis and the next Person id) '''
+
+        # start a new file
+        if self._saved is None:
+            header = {"version": VERSION, "fingerprint": self.fingerprint}
+
+            with open(self.filename, 'wb') as output:
+                _write(output, header)
+                self._end = output.tell()
+
+            self._saved = {"audience": {}, "people": []}
+
+        record = {"offset": offset,
+                  "ids": ids,
+                  "audience": (audience.checkpointState(),
+                               self._chunks(self._saved["audience"],
+                                            audience.checkpointColumns())),
+                  "people": []}
+
+        for index, person in enumerate(audience._people):
+
+            # Persons are only ever appended to the Audience
+            if index == len(self._saved["people"]):
+                self._saved["people"].append({})
+
+            record["people"].append(
+                (person.checkpointState(),
+                 self._chunks(self._saved["people"][index],
+                              person.checkpointColumns())))
+
+        # append after the last complete record (dropping a partial one)
+        with open(self.filename, 'r+b') as output:
+            output.seek(self._end)
+            output.truncate()
+            _write(output, record)
+            output.flush()
+            os.fsync(output.fileno())
+            self._end = output.tell()
+
+        self._last = timer()
+
+
+    def load(self):
+        ''' return the saved state, None if there is no checkpoint
+            or if it belongs to another analysis
+
+            The state has the offset, the ids, and the (state, columns)
+            of the Audience and of each Person. '''
+
+        if not os.path.exists(self.filename):
+            return None
+
+        with open(self.filename, 'rb') as source:
+
+            header = _read(source)
+
+            if not isinstance(header, dict) or \
+                    header.get("version") != VERSION:
+                print("Ignoring checkpoint '%s': unknown version" %
+                      (self.filename))
+                return None
+
+            if header["fingerprint"] != self.fingerprint:
+                print("Ignoring checkpoint '%s': the input or its settings "
+                      "have changed" % (self.filename))
+                return None
+
+            state = None
+            end = source.tell()
+
+            # join the chunks of the complete records
+            while True:
+
+                record = _read(source)
+
+                if record is None:
+                    break
+
+                end = source.tell()
+
+                if state is None:
+                    state = record
+                    continue
+
+                audienceState, chunks = record["audience"]
+                state["audience"] = (audienceState,
+                                     _join(state["audience"][1], chunks))
+
+                people = state["people"]
+
+                for index, (personState, chunks) in \
+                        enumerate(record["people"]):
+
+                    if index < len(people):
+                        people[index] = (personState,
+                                         _join(people[index][1], chunks))
+                    else:
+                        people.append((personState, chunks))
+
+                state["offset"] = record["offset"]
+                state["ids"] = record["ids"]
+
+        if state is None:
+            return None
+
+        # the next records are appended to this file
+        self._end = end
+        self._saved = {"audience": _lengths(state["audience"][1]),
+                       "people": [_lengths(columns)
+                                  for personState, columns
+                                  in state["people"]]}
+
+        return state
+
+
+    def _chunks(self, saved, columns):
+        ''' return the items appended to the columns since they were
+            last saved, and update their saved lengths '''
+
+        chunks = {}
+
+        for name, column in columns.items():
+            chunks[name] = column[saved.get(name, 0):]
+            saved[name] = len(column)
+
+        return chunks
+
+
+def fingerprint(conf_input):
+    '''Return what identifies the analysis of an input: the log file
+       (path, size and modification time) and the settings'''
+
+    status = os.stat(conf_input.filename)
+
+    return {"filename": os.path.abspath(conf_input.filename),
+            "size": status.st_size,
+            "mtime": status.st_mtime_ns,
+            "start_date": conf_input.start_date.isoformat(),
+            "filters": conf_input.filters,
+            "sample_rate": conf_input.sample_rate}
+
+
+def _write(output, item):
+    '''Write a length-prefixed pickled item'''
+
+    data = pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
+    output.write(LENGTH.pack(len(data)) + data)
+
+
+def _read(source):
+    '''Read a length-prefixed pickled item, None at the end of the file
+       or for an incomplete item (an interrupted write)'''
+
+    prefix = source.read(LENGTH.size)
+
+    if len(prefix) < LENGTH.size:
+        return None
+
+    length, = LENGTH.unpack(prefix)
+    data = source.read(length)
+
+    if len(data) < length:
+        return None
+
+    return pickle.loads(data)
+
+
+def _join(columns, chunks):
+    '''Append the chunks to the columns (arrays or lists)'''
+
+    for name, chunk in chunks.items():
+        columns[name].extend(chunk)
+
+    return columns
+
+
+def _lengths(columns):
+    '''Return the length of each column'''
+
+    return dict((name, len(column)) for name, column in columns.items())
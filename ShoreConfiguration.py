@@ -0,0 +1,486 @@
+#  Validation and compilation of ShoreAnalyser configurations.
+#  Copyright (c) 2013 Queen Mary University of London. All rights reserved.
+
+import os
+import re
+import math
+import json
+
+from datetime import timedelta
+
+import ShoreParser as sp
+from ShoreStatistics import STATISTICS
+
+
+# Numeric channels of a Person: name, SHORE key and CSV column prefix
+CHANNELS = [("uptime", "Uptime", "Uptime"),
+            ("score", "Score", "Score"),
+            ("surprised", "Surprised", "Surprise"),
+            ("sad", "Sad", "Sad"),
+            ("happy", "Happy", "Happy"),
+            ("angry", "Angry", "Angry"),
+            ("age", "Age", "Age"),
+            ("mouthOpen", "MouthOpen", "MouthOpen"),
+            ("leftEyeClosed", "LeftEyeClosed", "LeftEyeClosed"),
+            ("rightEyeClosed", "RightEyeClosed", "RightEyeClosed"),
+            ("pitch", "Pitch", "Pitch"),
+            ("roll", "Roll", "Roll"),
+            ("yaw", "Yaw", "Yaw")]
+
+# Columns (channel, statistic) exported by default
+COLUMNS = [("happy", "mean"),
+           ("sad", "mean"),
+           ("angry", "mean"),
+           ("surprised", "mean"),
+           ("mouthOpen", "mean"),
+           ("pitch", "mean"),
+           ("roll", "mean"),
+           ("yaw", "mean")]
+
+# Happy value (0-100) above which a face is counted as laughing
+LAUGH_THRESHOLD = 50.0
+
+# Seconds between the checkpoints of an input
+CHECKPOINT_INTERVAL = 300
+
+# Export types of a configuration item
+TYPES = ["person", "audience"]
+
+# Time format of the time ranges: '16:32:46' or '16:32:46.396849'
+TIME = re.compile(r'^\d+:[0-5]\d:[0-5]\d(\.\d{1,6})?$')
+
+
+class ConfigurationError(ValueError):
+    '''Invalid configuration (the message lists every error)'''
+
+    def __init__(self, errors):
+
+        self.errors = errors
+        ValueError.__init__(self, "invalid configuration\n  " +
+                            "\n  ".join(errors))
+
+
+class Configuration:
+    '''Configuration class (a compiled configuration file)'''
+
+    def __init__(self, inputs, configurations, output_report=None):
+
+        # save the properties
+        self.inputs = inputs
+        self.configurations = configurations
+        self.output_report = output_report
+
+
+class Input:
+    '''Input class (a compiled input)'''
+
+    def __init__(self, id, filename, start_date, start_frame=None,
+                 output_log=None, filters=None, sample_rate=None,
+                 checkpoint=None, checkpoint_interval=CHECKPOINT_INTERVAL):
+
+        # save the properties (start_date is corrected by start_frame)
+        self.id = id
+        self.filename = filename
+        self.start_date = start_date
+        self.start_frame = start_frame
+        self.output_log = output_log
+        self.filters = filters
+        self.sample_rate = sample_rate
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+
+
+class Output:
+    '''Output class (a compiled configuration item)'''
+
+    def __init__(self, output, time_ranges, columns=COLUMNS, type="person",
+                 laugh_threshold=LAUGH_THRESHOLD):
+
+        # save the properties
+        self.output = output
+        self.time_ranges = time_ranges
+        self.columns = columns
+        self.type = type
+        self.laugh_threshold = laugh_threshold
+
+
+class TimeRange:
+    '''TimeRange class (a compiled time range, times in microseconds)'''
+
+    def __init__(self, id, inputId, fromTime, toTime, label,
+                 window=1000000):
+
+        # save the properties
+        self.id = id
+        self.inputId = inputId
+        self.fromTime = fromTime
+        self.toTime = toTime
+        self.label = label
+        self.window = window
+
+
+def load(filename):
+    '''Load a configuration file and return it compiled'''
+
+    try:
+        with open(filename, 'r') as conf_source:
+            configuration = json.loads(conf_source.read())
+    except (IOError, ValueError) as error:
+        raise ConfigurationError(["%s: %s" % (filename, error)])
+
+    return compileConfiguration(configuration)
+
+
+def compileConfiguration(configuration):
+    '''Validate a configuration (as loaded from JSON) and return
+       a Configuration, raise ConfigurationError if it is invalid'''
+
+    if isinstance(configuration, Configuration):
+        return configuration
+
+    errors = []
+
+    if not _checkKeys(configuration, "configuration",
+                      ["inputs", "configurations"], ["output_report"],
+                      errors):
+        raise ConfigurationError(errors)
+
+    conf_inputs = _get(configuration, "inputs", "configuration", list,
+                       errors, [])
+    conf_items = _get(configuration, "configurations", "configuration",
+                      list, errors, [])
+    output_report = _get(configuration, "output_report", "configuration",
+                         str, errors)
+
+    # compile the inputs
+    inputs = []
+
+    for index, conf_input in enumerate(conf_inputs):
+
+        path = "inputs[%d]" % (index)
+        conf_input = _compileInput(conf_input, path, errors)
+
+        if conf_input is None:
+            continue
+
+        if conf_input.id in [other.id for other in inputs]:
+            errors.append("%s.id: duplicate input '%s'" %
+                          (path, conf_input.id))
+
+        inputs.append(conf_input)
+
+    # compile the outputs (time ranges refer to the inputs)
+    inputIds = [conf_input.id for conf_input in inputs]
+    configurations = []
+
+    for index, conf_item in enumerate(conf_items):
+
+        conf_item = _compileOutput(conf_item, inputIds,
+                                   "configurations[%d]" % (index), errors)
+        configurations.append(conf_item)
+
+    if errors:
+        raise ConfigurationError(errors)
+
+    return Configuration(inputs, configurations, output_report)
+
+
+def compileInput(conf_input):
+    '''Validate an input and return an Input'''
+
+    if isinstance(conf_input, Input):
+        return conf_input
+
+    errors = []
+    conf_input = _compileInput(conf_input, "input", errors)
+
+    if errors:
+        raise ConfigurationError(errors)
+
+    return conf_input
+
+
+def compileOutput(conf_item, inputIds=None):
+    '''Validate a configuration item and return an Output
+       (inputIds are the valid inputs, None accepts any input)'''
+
+    if isinstance(conf_item, Output):
+        return conf_item
+
+    errors = []
+    conf_item = _compileOutput(conf_item, inputIds, "configuration", errors)
+
+    if errors:
+        raise ConfigurationError(errors)
+
+    return conf_item
+
+
+def parseColumns(columns):
+    '''Parse columns ('happy' or 'happy:std') and return
+       a list of (channel, statistic)'''
+
+    errors = []
+    parsed = _parseColumns(columns, "columns", errors)
+
+    if errors:
+        raise ConfigurationError(errors)
+
+    return parsed
+
+
+def _compileInput(conf_input, path, errors):
+
+    if not _checkKeys(conf_input, path, ["id", "filename", "start_date"],
+                      ["start_frame", "sample_rate", "output_log",
+                       "filters", "checkpoint", "checkpoint_interval"],
+                      errors):
+        return None
+
+    # access properties
+    inputId = _getId(conf_input, "id", path, errors)
+    filename = _get(conf_input, "filename", path, str, errors)
+    start_date = _get(conf_input, "start_date", path, str, errors)
+
+    if filename is not None and not os.path.isfile(filename):
+        errors.append("%s.filename: file '%s' not found" % (path, filename))
+
+    if start_date is not None:
+        try:
+            start_date = sp._parsedate(start_date)
+        except ValueError:
+            errors.append("%s.start_date: invalid date '%s'" %
+                          (path, start_date))
+            start_date = None
+
+    # Check for optional key 'start_frame'
+    start_frame = _getNumber(conf_input, "start_frame", path, errors)
+
+    if start_frame is not None and start_frame < 0:
+        errors.append("%s.start_frame: must not be negative" % (path))
+
+    # calculate the correct date based on the starting frame
+    if start_frame is not None and start_date is not None:
+        try:
+            start_date -= timedelta(milliseconds=start_frame * 1000 / 29.97)
+        except OverflowError:
+            errors.append("%s.start_frame: frame %s is out of range" %
+                          (path, start_frame))
+            start_date = None
+
+    # Check for optional key 'sample_rate'
+    sample_rate = _getNumber(conf_input, "sample_rate", path, errors)
+
+    if sample_rate is not None and sample_rate <= 0:
+        errors.append("%s.sample_rate: must be positive" % (path))
+
+    # Check for optional keys 'output_log' and 'filters'
+    output_log = _get(conf_input, "output_log", path, str, errors)
+    filters = _get(conf_input, "filters", path, list, errors)
+
+    for index, conf_filter in enumerate(filters or []):
+        if not isinstance(conf_filter, dict):
+            errors.append("%s.filters[%d]: expected an object" %
+                          (path, index))
+
+    # Check for optional keys 'checkpoint' and 'checkpoint_interval'
+    checkpoint = _get(conf_input, "checkpoint", path, str, errors)
+    interval = _getNumber(conf_input, "checkpoint_interval", path, errors,
+                          CHECKPOINT_INTERVAL)
+
+    if interval <= 0:
+        errors.append("%s.checkpoint_interval: must be positive" % (path))
+
+    return Input(inputId, filename, start_date, start_frame, output_log,
+                 filters, sample_rate, checkpoint, interval)
+
+
+def _compileOutput(conf_item, inputIds, path, errors):
+
+    if not _checkKeys(conf_item, path, ["output", "time_ranges"],
+                      ["columns", "type", "laugh_threshold"], errors):
+        return None
+
+    # access properties
+    output = _get(conf_item, "output", path, str, errors)
+    conf_ranges = _get(conf_item, "time_ranges", path, list, errors, [])
+
+    # Check for optional key 'columns'
+    columns = _get(conf_item, "columns", path, list, errors)
+
+    if columns is not None:
+        if not columns:
+            errors.append("%s.columns: must not be empty" % (path))
+        columns = _parseColumns(columns, path + ".columns", errors)
+    else:
+        columns = COLUMNS
+
+    # Check for optional key 'type' (person or audience rows)
+    export_type = _get(conf_item, "type", path, str, errors, "person")
+
+    if export_type not in TYPES:
+        errors.append("%s.type: unknown export type '%s'" %
+                      (path, export_type))
+
+    # Check for optional key 'laugh_threshold'
+    threshold = _getNumber(conf_item, "laugh_threshold", path, errors,
+                           LAUGH_THRESHOLD)
+
+    # compile the time ranges
+    time_ranges = [_compileTimeRange(timerange, inputIds,
+                                     "%s.time_ranges[%d]" % (path, index),
+                                     errors)
+                   for index, timerange in enumerate(conf_ranges)]
+
+    return Output(output, time_ranges, columns, export_type,
+                  float(threshold))
+
+
+def _compileTimeRange(timerange, inputIds, path, errors):
+
+    if not _checkKeys(timerange, path, ["id", "inputId", "from", "to",
+                                        "label"], ["window"], errors):
+        return None
+
+    # access properties
+    rangeId = _getId(timerange, "id", path, errors)
+    inputId = _getId(timerange, "inputId", path, errors)
+    label = _get(timerange, "label", path, str, errors)
+
+    if inputId is not None and inputIds is not None and \
+            inputId not in inputIds:
+        errors.append("%s.inputId: unknown input '%s'" % (path, inputId))
+
+    # parse the times (in microseconds)
+    fromTime = _getTime(timerange, "from", path, errors)
+    toTime = _getTime(timerange, "to", path, errors)
+
+    if fromTime is not None and toTime is not None and fromTime >= toTime:
+        errors.append("%s: 'from' must be before 'to'" % (path))
+
+    # Check for optional key 'window' (in seconds, used in microseconds)
+    window = _getNumber(timerange, "window", path, errors, 1)
+
+    if round(window * 1000000) <= 0:
+        errors.append("%s.window: must be at least 1 microsecond" % (path))
+        window = 1
+
+    return TimeRange(rangeId, inputId, fromTime, toTime, label,
+                     int(round(window * 1000000)))
+
+
+def _parseColumns(columns, path, errors):
+
+    names = [name for name, key, prefix in CHANNELS]
+    parsed = []
+
+    for index, column in enumerate(columns):
+
+        if not isinstance(column, str):
+            errors.append("%s[%d]: expected a string" % (path, index))
+            continue
+
+        # the statistic is the mean by default
+        if ":" in column:
+            channel, statistic = column.split(":", 1)
+        else:
+            channel, statistic = column, "mean"
+
+        if channel not in names:
+            errors.append("%s[%d]: unknown channel '%s'" %
+                          (path, index, channel))
+
+        elif statistic not in STATISTICS:
+            errors.append("%s[%d]: unknown statistic '%s'" %
+                          (path, index, statistic))
+
+        else:
+            parsed.append((channel, statistic))
+
+    return parsed
+
+
+def _checkKeys(item, path, required, optional, errors):
+    '''Check the required and unknown keys of an object'''
+
+    if not isinstance(item, dict):
+        errors.append("%s: expected an object" % (path))
+        return False
+
+    for key in required:
+        if key not in item:
+            errors.append("%s: missing key '%s'" % (path, key))
+
+    for key in item:
+        if key not in required and key not in optional:
+            errors.append("%s: unknown key '%s'" % (path, key))
+
+    return True
+
+
+def _get(item, key, path, types, errors, default=None):
+    '''Return the value of a key if it has the expected type'''
+
+    if key not in item:
+        return default
+
+    value = item[key]
+
+    # bool is an int, but never a valid number here
+    if not isinstance(value, types) or isinstance(value, bool):
+        errors.append("%s.%s: expected %s" % (path, key, _describe(types)))
+        return default
+
+    return value
+
+
+def _getNumber(item, key, path, errors, default=None):
+    '''Return the value of a numeric key if it is a finite number
+       (JSON accepts NaN and Infinity)'''
+
+    value = _get(item, key, path, (int, float), errors, default)
+
+    if value is not None and not math.isfinite(value):
+        errors.append("%s.%s: expected a finite number" % (path, key))
+        return default
+
+    return value
+
+
+def _getId(item, key, path, errors):
+    '''Return an id (a string or an integer) as a string'''
+
+    value = _get(item, key, path, (str, int), errors)
+
+    if value is None:
+        return None
+
+    return str(value)
+
+
+def _getTime(timerange, key, path, errors):
+    '''Return a time of a time range in microseconds'''
+
+    time = _get(timerange, key, path, str, errors)
+
+    if time is None:
+        return None
+
+    if not TIME.match(time):
+        errors.append("%s.%s: invalid time '%s'" % (path, key, time))
+        return None
+
+    return sp.parsetime(time)
+
+
+def _describe(types):
+
+    if types is str:
+        return "a string"
+    elif types is list:
+        return "a list"
+    elif types == (str, int):
+        return "a string or an integer"
+    else:
+        return "a number"
+
@@ -0,0 +1,289 @@
+#  Per-stage timing and counters for ShoreAnalyser.
+#  Copyright (c) 2013 Queen Mary University of London. All rights reserved.
+
+import sys
+import json
+import tracemalloc
+
+from timeit import default_timer as timer
+
+# resource is only available on Unix platforms
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# peak resident memory of the process seen so far (KB), kept here
+# because measuring a stage resets the high-water mark of the process
+_processPeak = 0
+
+# True while the peak memory of a stage is measured
+_measuring = False
+
+
+class Instrumentation:
+    '''Instrumentation class
+
+       Records wall time and item counts per stage, the peak memory
+       of the process at the end of each stage, and the peak memory
+       allocated by the stages that run as blocks (with statements).
+       When disabled, all stages are shared no-op objects.'''
+
+    def __init__(self, enabled=True):
+
+        # save the state
+        self.enabled = enabled
+
+        # init the stages (kept in order of creation)
+        self._stages = []
+        self._names = {}
+
+        # shared stage used when disabled
+        self._disabled = _DisabledStage()
+
+
+    def stage(self, name):
+        ''' return the stage with the given name (created if needed) '''
+
+        if not self.enabled:
+            return self._disabled
+
+        if name not in self._names:
+
+            # create the stage
+            stage = Stage(name)
+
+            # add it to the list
+            self._stages.append(stage)
+            self._names[name] = stage
+
+        return self._names[name]
+
+
+    def stages(self):
+        return self._stages[:]
+
+
+    def report(self):
+        ''' return a text report of all stages '''
+
+        report = ""
+
+        for stage in self._stages:
+
+            report += "%-40s %10.3fs %10d items" % (stage.name,
+                                                   stage.seconds,
+                                                   stage.items)
+
+            if stage.items and stage.seconds > 0:
+                report += " %12.1f/s" % (stage.items / stage.seconds)
+
+            if stage.peak_memory is not None:
+                report += " %10d KB stage peak" % (stage.peak_memory)
+
+            if stage.process_peak_memory is not None:
+                report += " %10d KB process peak" % (
+                    stage.process_peak_memory)
+
+            report += "\n"
+
+        return report
+
+
+    def write(self, filename):
+        ''' write a machine-readable (JSON) report of all stages '''
+
+        stages = [stage.toDict() for stage in self._stages]
+
+        with open(filename, "w") as output:
+            json.dump({"stages": stages}, output, indent=4)
+
+
+class Stage:
+    '''Stage class'''
+
+    def __init__(self, name):
+
+        # save the name
+        self.name = name
+
+        # init the counters
+        self.seconds = 0.0
+        self.items = 0
+        self.calls = 0
+        self.peak_memory = None
+        self.process_peak_memory = None
+
+        # start time of the running measurement
+        self._start = None
+
+        # baseline of the peak memory of the running block (None if
+        # it is not measured)
+        self._baseline = None
+
+
+    def start(self):
+        self._start = timer()
+
+
+    def stop(self, items=0):
+
+        # accumulate the elapsed time
+        self.seconds += timer() - self._start
+        self.items += items
+        self.calls += 1
+        self._start = None
+
+
+    def count(self, items=1):
+        self.items += items
+
+
+    def __enter__(self):
+
+        # measure the peak memory of the block
+        self._baseline = _startPeak()
+
+        self.start()
+        return self
+
+
+    def __exit__(self, *args):
+        self.stop()
+
+        if self._baseline is not None:
+
+            # keep the largest peak of all the runs of the block
+            peak = _stopPeak(self._baseline)
+            self._baseline = None
+
+            self.peak_memory = max(peak, self.peak_memory or 0)
+
+        self.recordMemory()
+
+
+    def recordMemory(self):
+
+        # high-water mark of the whole process at the end of the stage
+        # (not of this stage alone, parse and track alternate per line)
+        self.process_peak_memory = _peakMemory()
+
+
+    def toDict(self):
+
+        return {"name": self.name,
+                "seconds": self.seconds,
+                "items": self.items,
+                "calls": self.calls,
+                "peak_memory_kb": self.peak_memory,
+                "process_peak_memory_kb": self.process_peak_memory}
+
+
+class _DisabledStage:
+    '''Stage that records nothing'''
+
+    def start(self):
+        pass
+
+    def stop(self, items=0):
+        pass
+
+    def count(self, items=1):
+        pass
+
+    def recordMemory(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+def _peakMemory():
+    '''Return the peak resident memory of the process in KB'''
+
+    global _processPeak
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in bytes on macOS and in KB elsewhere
+    if sys.platform == 'darwin':
+        peak = peak // 1024
+
+    # ru_maxrss only covers the time since the last reset
+    _processPeak = max(_processPeak, peak)
+
+    return _processPeak
+
+
+def _startPeak():
+    '''Start measuring the peak memory of a block and return its
+       baseline (None if it cannot be measured)
+
+       On Linux the high-water mark of the process is reset, so the
+       block runs at full speed; elsewhere its allocations are traced.'''
+
+    global _measuring
+
+    # an enclosing block is measured
+    if _measuring:
+        return None
+
+    # keep the peak of the process before resetting it
+    _peakMemory()
+
+    resident = _residentMemory()
+
+    if resident is not None:
+        try:
+            with open("/proc/self/clear_refs", "w") as clear:
+                clear.write("5")
+            baseline = ("resident", resident)
+        except OSError:
+            resident = None
+
+    if resident is None:
+        if tracemalloc.is_tracing():
+            return None
+        tracemalloc.start()
+        baseline = ("traced", 0)
+
+    _measuring = True
+
+    return baseline
+
+
+def _stopPeak(baseline):
+    '''Return the peak memory of a block in KB, above its baseline'''
+
+    global _measuring
+
+    _measuring = False
+
+    kind, start = baseline
+
+    if kind == "traced":
+        peak = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+        return peak
+
+    return max(_residentMemory("VmHWM") - start, 0)
+
+
+def _residentMemory(key="VmRSS"):
+    '''Return a memory counter of the process in KB (Linux only)'''
+
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith(key + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    return None
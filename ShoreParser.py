@@ -2,17 +2,46 @@
 #  Copyright (c) 2013 Queen Mary University of London. All rights reserved.
 
 
+import io
 import sys
 import re
+import bz2
+import gzip
+import lzma
+import shutil
+import subprocess
 from datetime import datetime
 
+# zstandard is optional, the zstd tool is used when available
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# DeltaTime is relative to this date when no start_date is given
+EPOCH = datetime(1900, 1, 1)
+
+# Compressed formats: name, magic number and external decompressors
+# (fastest first). External tools run in their own process, in parallel
+# with the parser, and use multiple threads where the format allows.
+COMPRESSIONS = [
+    ('gzip', b'\x1f\x8b', [['pigz', '-dc'],
+                            ['gzip', '-dc']]),
+    ('bz2', b'BZh', [['lbzip2', '-dc'],
+                     ['pbzip2', '-dc'],
+                     ['bzip2', '-dc']]),
+    ('xz', b'\xfd7zXZ\x00', [['xz', '-dc', '-T0']]),
+    ('zstd', b'\x28\xb5\x2f\xfd', [['pzstd', '-dc'],
+                                  ['zstd', '-dc']])]
+
 
 def parsefile(inputFile, start_date=None):
     '''Parse a complete file and return as a list
        of dictionaries '''
 
     # open file
-    source = open(inputFile, 'r')
+    source = openfile(inputFile)
 
     # init list
     shoreList = []
@@ -33,6 +62,137 @@ def parsefile(inputFile, start_date=None):
     return shoreList
 
 
+def openfile(filename, binary=False):
+    '''Open a plain or compressed (gzip, bz2, xz, zstd) file
+       and return it as a text (or binary) stream '''
+
+    compression = _compression(filename)
+
+    # plain text
+    if compression is None:
+        return open(filename, 'rb' if binary else 'r')
+
+    name, magic, commands = compression
+
+    # stream from an external decompressor when available
+    for command in commands:
+        if shutil.which(command[0]) is not None:
+            return _ProcessFile(command, filename, binary)
+
+    mode = 'rb' if binary else 'rt'
+
+    # otherwise decompress in this process
+    if name == 'gzip':
+        return gzip.open(filename, mode)
+    elif name == 'bz2':
+        return bz2.open(filename, mode)
+    elif name == 'xz':
+        return lzma.open(filename, mode)
+    elif zstandard is not None:
+        return zstandard.open(filename, mode)
+    else:
+        sys.exit('Error: zstd or the zstandard module is required to read ' +
+                 filename)
+
+
+class LogReader:
+    '''Lines of a plain or compressed log that keeps the offset of the
+       next line (in bytes of the uncompressed data), so that reading
+       can continue from it later'''
+
+    def __init__(self, filename, offset=0):
+
+        self.offset = offset
+        self._stream = openfile(filename, binary=True)
+
+        # plain files seek directly
+        if _compression(filename) is None:
+            self._stream.seek(offset)
+
+        # compressed data is decompressed up to the offset
+        else:
+            remaining = offset
+            while remaining > 0:
+                skipped = len(self._stream.read(min(remaining, 1 << 20)))
+                if skipped == 0:
+                    sys.exit('Error: ' + filename + ' is shorter than ' +
+                             str(offset) + ' bytes')
+                remaining -= skipped
+
+    def __iter__(self):
+
+        for line in self._stream:
+
+            self.offset += len(line)
+
+            # same newlines as a text stream
+            if line.endswith(b'\r\n'):
+                line = line[:-2] + b'\n'
+
+            yield line.decode('utf-8')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._stream.close()
+
+
+def _compression(filename):
+    '''Return the compression of a file (from COMPRESSIONS)
+       or None for plain text '''
+
+    with open(filename, 'rb') as source:
+        header = source.read(6)
+
+    for compression in COMPRESSIONS:
+        if header.startswith(compression[1]):
+            return compression
+
+    return None
+
+
+class _ProcessFile:
+    '''Text (or binary) stream of the output of an external decompressor'''
+
+    def __init__(self, command, filename, binary=False):
+
+        self._command = command + [filename]
+        self._process = subprocess.Popen(self._command,
+                                         stdout=subprocess.PIPE)
+
+        if binary:
+            self._stream = self._process.stdout
+        else:
+            self._stream = io.TextIOWrapper(self._process.stdout)
+
+    def __iter__(self):
+        return iter(self._stream)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def readline(self):
+        return self._stream.readline()
+
+    def read(self, size=-1):
+        return self._stream.read(size)
+
+    def close(self):
+
+        self._stream.close()
+
+        # negative codes are signals (e.g. SIGPIPE when closed early)
+        if self._process.wait() > 0:
+            sys.exit('Error: ' + ' '.join(self._command) + ' failed')
+
+
 def parseline(line, start_date=None):
     '''Parse the line and return in dictionary'''
 
@@ -82,10 +242,10 @@ def parseline(line, start_date=None):
             else:
 
                 # just provide the original date
-                deltatime = value
+                deltatime = value - EPOCH
 
-            # also add the DeltaTime to the dictionary
-            dictionary["DeltaTime"] = _parsetime(str(deltatime))
+            # also add the DeltaTime (in microseconds) to the dictionary
+            dictionary["DeltaTime"] = microseconds(deltatime)
 
         # add to the dictionary
         dictionary[key] = value
@@ -107,20 +267,37 @@ def _parsedate(date):
     return value
 
 
-def _parsetime(time):
-    '''Parse a time in string and return a datetime object'''
+def microseconds(delta):
+    '''Return a timedelta as an integer number of microseconds'''
+
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
 
-    if len(time) <= 8:
-        # Datetime format: '16:32:46'
-        value = datetime.strptime(time, '%H:%M:%S')
-    elif len(time) <= 15:
-        # Datetime format: '16:32:46.396849'
-        value = datetime.strptime(time, '%H:%M:%S.%f')
+def parsetime(time):
+    '''Parse a time in string ('16:32:46' or '16:32:46.396849')
+       and return it in microseconds'''
+
+    hours, minutes, seconds = time.split(':')
+
+    # the fraction of the second is optional
+    if '.' in seconds:
+        seconds, fraction = seconds.split('.')
+        fraction = int((fraction + '00000')[:6])
     else:
-        # Datetime format: '2013-06-12 13:24:30.310070'
-        value = datetime.strptime(time, '%Y-%m-%d %H:%M:%S.%f')
+        fraction = 0
 
-    return value
+    return ((int(hours) * 60 + int(minutes)) * 60 +
+            int(seconds)) * 1000000 + fraction
+
+
+def formattime(time):
+    '''Format a time in microseconds as a string ('16:32:46.396849')'''
+
+    seconds, fraction = divmod(time, 1000000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+
+    return "%02d:%02d:%02d.%06d" % (hours % 24, minutes, seconds, fraction)
 
 
 def _parseitem(item):
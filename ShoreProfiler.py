@@ -0,0 +1,235 @@
+#  Opt-in profiler for the ShoreAnalyser entry point.
+#  Copyright (c) 2013 Queen Mary University of London. All rights reserved.
+
+import os
+import re
+import signal
+import cProfile
+import pstats
+
+from io import StringIO
+
+
+# Only functions of these modules are listed in the per-function report
+SCOPE = r'Shore(Parser|Analyser|Statistics|Checkpoint)\.py'
+
+# Sampling interval in seconds
+INTERVAL = 0.001
+
+
+def samplingAvailable():
+    '''Return True if the sampling profiler can be used on this platform'''
+
+    return hasattr(signal, 'setitimer') and hasattr(signal, 'SIGPROF')
+
+
+class Profiler:
+    '''Profiler class
+
+       Runs a function under cProfile or a sampling profiler and writes
+       a per-function report (<prefix>.txt) and a collapsed-stack file
+       for flamegraphs (<prefix>.folded).'''
+
+    def __init__(self, prefix, mode='auto', interval=INTERVAL):
+
+        # use the sampling profiler when available
+        if mode == 'auto':
+            if samplingAvailable():
+                mode = 'sampling'
+            else:
+                mode = 'cprofile'
+
+        if mode == 'sampling' and not samplingAvailable():
+            raise ValueError("Sampling profiler is not available "
+                             "on this platform")
+
+        if mode not in ['sampling', 'cprofile']:
+            raise ValueError("Unknown profiler mode '%s'" % (mode))
+
+        # save the properties
+        self.prefix = prefix
+        self.mode = mode
+        self.interval = interval
+
+        # results of the run
+        self._stats = None
+        self._samples = {}
+
+
+    def runcall(self, function, *args, **kwargs):
+        ''' run the function under the profiler and return its result '''
+
+        if self.mode == 'cprofile':
+
+            profile = cProfile.Profile()
+
+            try:
+                return profile.runcall(function, *args, **kwargs)
+            finally:
+                self._stats = pstats.Stats(profile, stream=StringIO())
+
+        else:
+
+            # sample the stack on every tick of the CPU timer
+            previous = signal.signal(signal.SIGPROF, self._sample)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+            try:
+                return function(*args, **kwargs)
+            finally:
+                signal.setitimer(signal.ITIMER_PROF, 0, 0)
+                signal.signal(signal.SIGPROF, previous)
+
+
+    def write(self):
+        ''' write the report and collapsed-stack files and
+            return their filenames '''
+
+        report = self.prefix + ".txt"
+        folded = self.prefix + ".folded"
+
+        if self.mode == 'cprofile':
+            stacks = self._cprofileStacks()
+            text = self._cprofileReport()
+        else:
+            stacks = self._samples
+            text = self._samplingReport()
+
+        with open(report, "w") as output:
+            output.write(text)
+
+        with open(folded, "w") as output:
+            for stack, count in sorted(stacks.items()):
+                output.write("%s %d\n" % (";".join(stack), count))
+
+        return report, folded
+
+
+    def _sample(self, signum, frame):
+
+        # walk the stack from the current frame to the root
+        stack = []
+        while frame is not None:
+            stack.append(_label(frame))
+            frame = frame.f_back
+
+        stack.reverse()
+
+        # count the stack
+        stack = tuple(stack)
+        self._samples[stack] = self._samples.get(stack, 0) + 1
+
+
+    def _samplingReport(self):
+
+        total = sum(self._samples.values())
+
+        # self and total samples for each function
+        own = {}
+        cumulative = {}
+
+        for stack, count in self._samples.items():
+
+            own[stack[-1]] = own.get(stack[-1], 0) + count
+
+            # count recursive functions once per stack
+            for function in set(stack):
+                cumulative[function] = cumulative.get(function, 0) + count
+
+        report = "Sampling profile: %d samples every %.1f ms\n\n" % \
+            (total, self.interval * 1000)
+        report += "%10s %8s %10s %8s  %s\n" % \
+            ("self", "self%", "total", "total%", "function")
+
+        # only report functions in scope, ordered by self samples
+        functions = [function for function in cumulative.keys()
+                     if re.search(SCOPE, function)]
+        functions.sort(key=lambda x: (own.get(x, 0), cumulative[x]),
+                       reverse=True)
+
+        for function in functions:
+            report += "%10d %7.1f%% %10d %7.1f%%  %s\n" % \
+                (own.get(function, 0), _percent(own.get(function, 0), total),
+                 cumulative[function], _percent(cumulative[function], total),
+                 function)
+
+        return report
+
+
+    def _cprofileReport(self):
+
+        stream = StringIO()
+
+        self._stats.stream = stream
+
+        # report the functions in scope by internal and cumulative time
+        self._stats.sort_stats('time').print_stats(SCOPE)
+        self._stats.sort_stats('cumulative').print_stats(SCOPE)
+
+        return stream.getvalue()
+
+
+    def _cprofileStacks(self):
+        ''' approximate collapsed stacks from the cProfile call graph,
+            following the heaviest caller of every function '''
+
+        stats = self._stats.stats
+        stacks = {}
+
+        for function, (cc, nc, tt, ct, callers) in stats.items():
+
+            # internal time in microseconds
+            count = int(tt * 1000000)
+            if count == 0:
+                continue
+
+            stack = [_cprofileLabel(function)]
+            visited = set([function])
+
+            # walk up through the heaviest callers
+            while callers:
+                caller = max(callers.keys(), key=lambda x: callers[x][3])
+                if caller in visited or caller not in stats:
+                    break
+
+                visited.add(caller)
+                stack.append(_cprofileLabel(caller))
+                callers = stats[caller][4]
+
+            stack.reverse()
+
+            stack = tuple(stack)
+            stacks[stack] = stacks.get(stack, 0) + count
+
+        return stacks
+
+
+def _label(frame):
+    '''Return the label of a frame (file:Class.function)'''
+
+    code = frame.f_code
+    name = code.co_name
+
+    # add the class name for methods
+    if 'self' in code.co_varnames[:code.co_argcount]:
+        instance = frame.f_locals.get('self')
+        if instance is not None:
+            name = instance.__class__.__name__ + "." + name
+
+    return "%s:%s" % (os.path.basename(code.co_filename), name)
+
+
+def _cprofileLabel(function):
+    '''Return the label of a cProfile function key (file:function)'''
+
+    filename, line, name = function
+
+    return "%s:%s" % (os.path.basename(filename), name)
+
+
+def _percent(value, total):
+
+    if total:
+        return 100.0 * value / total
+    else:
+        return 0.0
@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+
+#  Query server over analysed audiences.
+#  Copyright (c) 2013 Queen Mary University of London. All rights reserved.
+
+import io
+import os
+import sys
+import json
+import math
+import stat
+import numpy
+import argparse
+import threading
+import collections
+import socketserver
+
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import ShoreParser as sp
+import ShoreConfiguration as sc
+from ShoreAnalyser import ShoreAnalyser
+from ShoreConfiguration import CHANNELS, COLUMNS
+from ShoreStatistics import STATISTICS
+
+
+# Windows aggregated together and cached as one block
+BLOCK = 256
+
+# Number of blocks (of one column) kept in the LRU cache
+CACHE_SIZE = 4096
+
+# Maximum number of windows of a query
+MAX_WINDOWS = 100000
+
+
+class QueryServer:
+    '''QueryServer class
+
+       Answers exportTimerange-style queries from the audiences of a
+       ShoreAnalyser. The aggregates of each column are cached by blocks
+       of windows, so repeated and overlapping queries (with the same
+       window length and alignment) reuse them.'''
+
+    def __init__(self, analyser, cache_size=CACHE_SIZE,
+                 max_windows=MAX_WINDOWS):
+
+        # save the analyser
+        self.analyser = analyser
+
+        # save the maximum number of windows of a query
+        self.max_windows = max_windows
+
+        # LRU cache of blocks of aggregates
+        # ((input, step, phase, block, column) -> people x BLOCK array)
+        self._cache = collections.OrderedDict()
+        self._cacheSize = cache_size
+        self._hits = 0
+        self._misses = 0
+
+        # the cache is shared by the request threads
+        self._lock = threading.Lock()
+
+
+    def query(self, params):
+        ''' answer a query and return the content type and body
+
+            params: input, from, to, and optionally window (seconds),
+                    columns (comma separated, as in the configuration),
+                    id, label and format (csv or json) '''
+
+        # get properties
+        inputId = _param(params, "input")
+        fromTime = _time(params, "from")
+        toTime = _time(params, "to")
+        window = float(_param(params, "window", "1"))
+        rangeId = _param(params, "id", "Query")
+        label = _param(params, "label", "")
+        output_format = _param(params, "format", "csv")
+
+        if inputId not in self.analyser.audience:
+            raise ValueError("Unknown input '%s'" % (inputId))
+
+        if fromTime >= toTime:
+            raise ValueError("'from' must be before 'to'")
+
+        if not math.isfinite(window) or window <= 0:
+            raise ValueError("Window must be positive")
+
+        # window in microseconds
+        step = int(round(window * 1000000))
+
+        if step == 0:
+            raise ValueError("Window must be at least 1 microsecond")
+
+        # number of windows (the last one may end after 'to')
+        count = -(-(toTime - fromTime) // step)
+
+        if count > self.max_windows:
+            raise ValueError("Too many windows (%d, at most %d)" %
+                             (count, self.max_windows))
+
+        # select the columns (same as the export)
+        columns = _param(params, "columns", None)
+
+        if columns is None:
+            columns = COLUMNS
+        else:
+            columns = sc.parseColumns(columns.split(","))
+
+        if not columns:
+            raise ValueError("No columns")
+
+        starts = numpy.arange(fromTime, toTime, step, dtype=numpy.int64)
+        results = self._aggregates(inputId, fromTime, count, step, columns)
+
+        if output_format == "csv":
+            return "text/csv", self._csv(starts, step, results, columns,
+                                         rangeId, label)
+        elif output_format == "json":
+            return "application/json", self._json(starts, step, results,
+                                                  columns, rangeId, label)
+        else:
+            raise ValueError("Unknown format '%s'" % (output_format))
+
+
+    def info(self):
+        ''' return the inputs and the cache statistics '''
+
+        inputs = {}
+
+        for inputId, audience in self.analyser.audience.items():
+            inputs[inputId] = {"frames": audience._frames,
+                               "people": len(audience.getValidPeople())}
+
+        with self._lock:
+            cache = {"hits": self._hits,
+                     "misses": self._misses,
+                     "size": len(self._cache),
+                     "maxsize": self._cacheSize}
+
+        return {"inputs": inputs, "cache": cache}
+
+
+    def _aggregates(self, inputId, fromTime, count, step, columns):
+        ''' return (person id, column arrays) of the windows of a query,
+            joined from the cached blocks that cover them '''
+
+        people = self.analyser.audience[inputId].getValidPeople()
+
+        # windows start at phase + index * step, in blocks of BLOCK windows
+        phase = fromTime % step
+        first = fromTime // step
+        firstBlock = first // BLOCK
+        lastBlock = (first + count - 1) // BLOCK
+
+        blocks = [self._block(inputId, people, step, phase, block, columns)
+                  for block in range(firstBlock, lastBlock + 1)]
+
+        # join the blocks of each column and keep the windows of the query
+        begin = first - firstBlock * BLOCK
+        values = [numpy.hstack([block[index] for block in blocks])
+                  [:, begin:begin + count]
+                  for index in range(len(columns))]
+
+        return [(person.id, [column[row] for column in values])
+                for row, person in enumerate(people)]
+
+
+    def _block(self, inputId, people, step, phase, block, columns):
+        ''' return the aggregates (people x BLOCK) of each column over a
+            block of windows, computing only the columns not cached '''
+
+        keys = [(inputId, step, phase, block, column) for column in columns]
+
+        with self._lock:
+            cached = [self._get(key) for key in keys]
+
+        missing = [column for column, values in zip(columns, cached)
+                   if values is None]
+
+        if not missing:
+            return cached
+
+        # aggregate all windows of the block of each person in one pass
+        starts = phase + (block * BLOCK +
+                          numpy.arange(BLOCK, dtype=numpy.int64)) * step
+        results = [person.aggregateWindows(starts, starts + step, missing)
+                   for person in people]
+
+        computed = {}
+
+        for index, column in enumerate(missing):
+            computed[column] = numpy.array(
+                [result[index] for result in results],
+                dtype=float).reshape(len(people), BLOCK)
+
+        with self._lock:
+            for key, column in zip(keys, columns):
+                if column in computed:
+                    self._put(key, computed[column])
+
+        return [computed[column] if values is None else values
+                for column, values in zip(columns, cached)]
+
+
+    def _get(self, key):
+        ''' return a cached block (None if missing), most recent first '''
+
+        values = self._cache.get(key)
+
+        if values is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+            self._cache.move_to_end(key)
+
+        return values
+
+
+    def _put(self, key, values):
+        ''' cache a block, dropping the least recently used '''
+
+        self._cache[key] = values
+        self._cache.move_to_end(key)
+
+        while len(self._cache) > self._cacheSize:
+            self._cache.popitem(last=False)
+
+
+    def _csv(self, starts, step, results, columns, rangeId, label):
+
+        output = io.StringIO()
+
+        # same header and rows as the export
+        self.analyser.exportHeader(output, columns)
+
+        # iterate through the windows, then the people
+        for index in range(len(starts)):
+            for person, values in results:
+                self.analyser.exportElements(
+                    rangeId, label, int(starts[index]),
+                    int(starts[index]) + step, person,
+                    [(statistic, result[index])
+                     for (channel, statistic), result
+                     in zip(columns, values)],
+                    output)
+
+        return output.getvalue()
+
+
+    def _json(self, starts, step, results, columns, rangeId, label):
+
+        headers = _headers(columns)
+        rows = []
+
+        for index in range(len(starts)):
+
+            timeFrom = sp.formattime(int(starts[index]))
+            timeTo = sp.formattime(int(starts[index]) + step)
+
+            for person, values in results:
+
+                row = {"person": person,
+                       "from": timeFrom,
+                       "to": timeTo,
+                       "id": rangeId,
+                       "label": label}
+
+                for header, (channel, statistic), result in zip(
+                        headers, columns, values):
+                    row[header] = _number(result[index], statistic)
+
+                rows.append(row)
+
+        return json.dumps({"rows": rows})
+
+
+class _Handler(BaseHTTPRequestHandler):
+    '''HTTP request handler of the QueryServer'''
+
+    def do_GET(self):
+
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+
+        queryServer = self.server.queryServer
+
+        try:
+            if url.path == "/query":
+                content_type, body = queryServer.query(params)
+            elif url.path == "/info":
+                content_type = "application/json"
+                body = json.dumps(queryServer.info())
+            else:
+                self.send_error(404, "Unknown path '%s'" % (url.path))
+                return
+
+        except (KeyError, ValueError, OverflowError) as error:
+            self.send_error(400, str(error))
+            return
+
+        body = body.encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def address_string(self):
+
+        # Unix sockets have no client address
+        if not self.client_address:
+            return "unix"
+
+        return BaseHTTPRequestHandler.address_string(self)
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn,
+                      socketserver.UnixStreamServer):
+    '''HTTP server on a Unix socket'''
+
+    daemon_threads = True
+
+
+def serve(queryServer, host="127.0.0.1", port=8000, socket=None):
+    ''' serve the queries over HTTP (TCP or a Unix socket) '''
+
+    if socket is not None:
+
+        # remove a stale socket (never another kind of file)
+        if os.path.exists(socket):
+            if not _isSocket(socket):
+                sys.exit("Error: '%s' exists and is not a socket" % (socket))
+            os.remove(socket)
+
+        server = _UnixHTTPServer(socket, _Handler)
+        address = socket
+
+    else:
+        server = ThreadingHTTPServer((host, port), _Handler)
+        address = "http://%s:%d" % (host, port)
+
+    server.queryServer = queryServer
+
+    print("Serving queries on '%s'.." % (address))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+        if socket is not None and _isSocket(socket):
+            os.remove(socket)
+
+
+def _isSocket(path):
+    '''Return True if the path exists and is a socket'''
+
+    try:
+        return stat.S_ISSOCK(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+def _param(params, key, default=KeyError):
+    '''Return a single query parameter'''
+
+    if key in params:
+        return params[key][0]
+
+    if default is KeyError:
+        raise KeyError("Missing parameter '%s'" % (key))
+
+    return default
+
+
+def _time(params, key):
+    '''Return a time query parameter in microseconds'''
+
+    time = _param(params, key)
+
+    # same format as the time ranges of the configuration
+    if not sc.TIME.match(time):
+        raise ValueError("Invalid time '%s' for '%s'" % (time, key))
+
+    return sp.parsetime(time)
+
+
+def _number(value, statistic):
+    '''Convert numpy values to float, or int for counts (None for NaN)'''
+
+    if numpy.isnan(value):
+        return None
+
+    if statistic == "count":
+        return int(value)
+
+    return float(value)
+
+
+def _headers(columns):
+    '''Return the CSV column names of the columns'''
+
+    prefixes = dict((name, prefix) for name, key, prefix in CHANNELS)
+
+    return ["%s_%s" % (prefixes[channel], STATISTICS[statistic])
+            for channel, statistic in columns]
+
+
+''' main '''
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Analyse SHORE log files once and answer '
+                    'time range queries over HTTP.')
+    parser.add_argument('configuration',
+                        help='configuration file (JSON), only the '
+                             'inputs are used')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='host to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='port to listen on (default: 8000)')
+    parser.add_argument('--socket',
+                        help='listen on this Unix socket instead')
+    parser.add_argument('--cache', type=int, default=CACHE_SIZE,
+                        help='number of cached blocks of %d windows of '
+                             'one column (default: %d)' %
+                             (BLOCK, CACHE_SIZE))
+    parser.add_argument('--max-windows', type=int, default=MAX_WINDOWS,
+                        help='maximum number of windows of a query '
+                             '(default: %d)' % (MAX_WINDOWS))
+    args = parser.parse_args()
+
+    # load and validate the configuration file
+    try:
+        configuration = sc.load(args.configuration)
+    except sc.ConfigurationError as error:
+        sys.exit('Error: ' + str(error))
+
+    # analyse the inputs once
+    analyser = ShoreAnalyser(configuration.inputs)
+
+    serve(QueryServer(analyser, args.cache, args.max_windows), args.host, args.port,
+          args.socket)
@@ -0,0 +1,185 @@
+#  NaN-aware aggregation of channel data over windows.
+#  Copyright (c) 2013 Queen Mary University of London. All rights reserved.
+
+import numpy
+
+
+# Statistics that can be computed and their CSV column suffix
+STATISTICS = {"mean": "AVG",
+              "median": "MEDIAN",
+              "min": "MIN",
+              "max": "MAX",
+              "std": "STD",
+              "count": "COUNT"}
+
+
+def aggregate(values, weights, fromIndexes, toIndexes, statistics):
+    '''Aggregate channels over windows in one vectorized pass.
+
+       values:      2D array (channels x samples), NaN for missing values
+       weights:     number of detections of each sample, 1D array (all
+                    channels) or 2D array (channels x samples)
+       fromIndexes: 1D array, first sample of each window
+       toIndexes:   1D array, end of each window (excluded)
+       statistics:  names of the statistics (see STATISTICS)
+
+       Return a dictionary of 2D arrays (channels x windows) for each
+       statistic. Windows without valid values are NaN (count is 0).
+       Mean, std and count are weighted, median, min and max are not.'''
+
+    values = numpy.asarray(values, dtype=float)
+    weights = numpy.asarray(weights, dtype=float)
+    fromIndexes = numpy.asarray(fromIndexes, dtype=numpy.intp)
+    toIndexes = numpy.asarray(toIndexes, dtype=numpy.intp)
+
+    channels, samples = values.shape
+    windows = len(fromIndexes)
+
+    for statistic in statistics:
+        if statistic not in STATISTICS:
+            raise ValueError("Unknown statistic '%s'" % (statistic))
+
+    # without samples every window is empty
+    if samples == 0 or windows == 0:
+        empty = numpy.full((channels, windows), numpy.nan)
+        result = dict((statistic, empty.copy()) for statistic in statistics)
+        if "count" in result:
+            result["count"] = numpy.zeros((channels, windows))
+        return result
+
+    valid = ~numpy.isnan(values)
+    weighted = numpy.where(valid, weights, 0.0)
+
+    # reduce [from, to) of every window: reduceat gets the interleaved
+    # bounds and a padding sample so that the last bound is valid
+    bounds = numpy.empty(2 * windows, dtype=numpy.intp)
+    bounds[0::2] = fromIndexes
+    bounds[1::2] = toIndexes
+    empty = toIndexes <= fromIndexes
+
+    def reduce(ufunc, data, padding):
+        padded = numpy.concatenate(
+            [data, numpy.full((channels, 1), padding)], axis=1)
+        return ufunc.reduceat(padded, bounds, axis=1)[:, 0::2]
+
+    count = reduce(numpy.add, weighted, 0.0)
+    count[:, empty] = 0.0
+
+    missing = count == 0
+
+    result = {}
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+
+        if "mean" in statistics or "std" in statistics:
+            total = reduce(numpy.add, numpy.where(valid, values * weights, 0.0),
+                           0.0)
+            mean = total / count
+            mean[missing] = numpy.nan
+
+            if "mean" in statistics:
+                result["mean"] = mean
+
+            if "std" in statistics:
+                squares = reduce(numpy.add,
+                                 numpy.where(valid, values * values * weights,
+                                             0.0), 0.0)
+                variance = numpy.maximum(squares / count - mean * mean, 0.0)
+                result["std"] = numpy.sqrt(variance)
+
+        if "min" in statistics:
+            minimum = reduce(numpy.minimum,
+                             numpy.where(valid, values, numpy.inf), numpy.inf)
+            minimum[missing] = numpy.nan
+            result["min"] = minimum
+
+        if "max" in statistics:
+            maximum = reduce(numpy.maximum,
+                             numpy.where(valid, values, -numpy.inf),
+                             -numpy.inf)
+            maximum[missing] = numpy.nan
+            result["max"] = maximum
+
+    # the median has no reduceat, compute it per window
+    if "median" in statistics:
+        median = numpy.full((channels, windows), numpy.nan)
+
+        for window in numpy.flatnonzero(~missing.all(axis=0)):
+            segment = slice(fromIndexes[window], toIndexes[window])
+            for channel in range(channels):
+                data = values[channel, segment]
+                data = data[valid[channel, segment]]
+                if len(data) > 0:
+                    median[channel, window] = numpy.median(data)
+
+        result["median"] = median
+
+    if "count" in statistics:
+        result["count"] = count
+
+    return result
+
+
+def check(trials=200, seed=0):
+    '''Check aggregate against the NaN-aware numpy functions on random
+       windows of random data with missing values (raise AssertionError
+       on a mismatch)'''
+
+    rand = numpy.random.RandomState(seed)
+
+    for trial in range(trials):
+
+        channels = rand.randint(1, 4)
+        samples = rand.randint(0, 50)
+        windows = rand.randint(1, 10)
+
+        # values with missing (NaN) values and weights of 1 to 3
+        values = rand.uniform(-100, 100, (channels, samples))
+        values[rand.uniform(size=values.shape) < 0.3] = numpy.nan
+        weights = rand.randint(1, 4, (channels, samples))
+
+        # random windows, some of them empty or reversed
+        fromIndexes = rand.randint(0, samples + 1, windows)
+        toIndexes = rand.randint(0, samples + 1, windows)
+
+        result = aggregate(values, weights, fromIndexes, toIndexes,
+                           list(STATISTICS))
+
+        for window in range(windows):
+            for channel in range(channels):
+
+                segment = slice(fromIndexes[window], toIndexes[window])
+                data = values[channel, segment]
+                valid = ~numpy.isnan(data)
+
+                # weighted statistics repeat each sample by its weight
+                repeated = numpy.repeat(data,
+                                        weights[channel, segment])[
+                    numpy.repeat(valid, weights[channel, segment])]
+
+                if not valid.any():
+                    expected = dict((statistic, numpy.nan)
+                                    for statistic in STATISTICS)
+                    expected["count"] = 0
+                else:
+                    expected = {"mean": numpy.mean(repeated),
+                                "std": numpy.std(repeated),
+                                "count": len(repeated),
+                                "median": numpy.nanmedian(data),
+                                "min": numpy.nanmin(data),
+                                "max": numpy.nanmax(data)}
+
+                for statistic, value in expected.items():
+                    actual = result[statistic][channel, window]
+                    assert numpy.allclose(actual, value, rtol=1e-9,
+                                          atol=1e-6, equal_nan=True), \
+                        "%s of window %d: %r != %r" % (statistic, window,
+                                                       actual, value)
+
+    return trials
+
+
+''' main '''
+if __name__ == '__main__':
+
+    print("aggregate matches numpy on %d random cases." % (check()))